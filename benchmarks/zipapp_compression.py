@@ -0,0 +1,61 @@
+"""Compare Bork's archive writer against zipapp.create_archive
+
+Usage: python benchmarks/zipapp_compression.py [SOURCE_DIR]
+
+Both compress every file of SOURCE_DIR (by default, the standard library
+of the running Python) into a zipapp; Bork's writer is timed with a single
+thread, and with one thread per CPU.
+"""
+
+from functools import partial
+from pathlib import Path
+from tempfile import TemporaryDirectory
+import os, sys, sysconfig, time, zipapp
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from bork import archive  # noqa: E402
+
+
+def files(src: Path):
+    for dirpath, dirnames, filenames in os.walk(src):
+        dirnames[:] = sorted(d for d in dirnames if d != "__pycache__")
+        for name in sorted(filenames):
+            path = Path(dirpath) / name
+            if path.is_file():
+                yield path, path.relative_to(src).as_posix()
+
+
+def stdlib(src: Path, target: Path) -> None:
+    zipapp.create_archive(src, target, main = "bench:main", compressed = True,
+                          filter = lambda path: "__pycache__" not in path.parts)
+
+
+def bork(src: Path, target: Path, *, workers: int | None) -> None:
+    entries = (
+        partial(archive.Entry.from_bytes, name, path.read_bytes())
+        for path, name in files(src)
+    )
+    archive.write(target, archive.concurrently(entries, workers = workers))
+
+
+def main(argv: list[str]) -> None:
+    src = Path(argv[0] if argv else sysconfig.get_path("stdlib"))
+    size = sum(path.stat().st_size for path, _ in files(src))
+    print(f"Compressing '{src}' ({size / 1024**2:.1f} MiB)")
+
+    with TemporaryDirectory() as tmp:
+        for label, write in (
+            ("zipapp.create_archive", stdlib),
+            ("bork.archive, 1 thread", partial(bork, workers = 1)),
+            (f"bork.archive, {os.cpu_count()} thread(s)", partial(bork, workers = None)),
+        ):
+            target = Path(tmp) / "bench.pyz"
+            start = time.perf_counter()
+            write(src, target)
+            elapsed = time.perf_counter() - start
+            print(f"{label:>30}: {elapsed:6.2f}s, {target.stat().st_size / 1024**2:.1f} MiB")
+            target.unlink()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,3 +1,5 @@
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict
 from functools import partial
 from pathlib import Path
 from signal import Signals
@@ -5,7 +7,7 @@ import subprocess
 import sys
 from warnings import warn
 
-from . import builder
+from . import builder, startup
 from .config import Config
 from .creds import Credentials
 from .filesystem import try_delete
@@ -17,18 +19,50 @@ def aliases():
     return Config.from_project(Path.cwd()).bork.aliases
 
 
-def build():
-    """Build the project."""
-    with builder.prepare(src = Path.cwd(), dst = Path.cwd() / 'dist') as b:
-        b.build("sdist")
-        b.build("wheel")
+def build(cache=True, zipapp=False, zipapp_main=None, parallel=False, wheel_from_sdist=False):
+    """Build the project.
 
+    If `zipapp` is True, also build the configured ZipApps, reusing the same build environment and wheel.
+    If `cache` is False, build in a fresh isolated environment.
+    If `parallel` is True, build the sdist and wheel concurrently.
+    If `wheel_from_sdist` is True, build the wheel from the sdist rather than the source tree.
+    """
+    with builder.prepare(src = Path.cwd(), dst = Path.cwd() / 'dist', cache = cache) as b:
+        b.build_all(parallel = parallel, from_sdist = wheel_from_sdist)
+        if zipapp:
+            b.zipapps(zipapp_main)
+
+
+def build_zipapp(zipapp_main=None, cache=True):
+    """Build the project's ZipApps.
+
+    Prefer `build(zipapp=True)` when also building the sdist and wheel.
+    """
+    with builder.prepare(src = Path.cwd(), dst = Path.cwd() / 'dist', cache = cache) as b:
+        b.zipapps(zipapp_main)
+
+
+def zipapp_profile(archive=None, baseline=None, runs=10, args=("--help",)):
+    """Measure how fast a ZipApp starts, and optionally a baseline to compare it against.
 
-def build_zipapp(zipapp_main=None):
-    """Build the project as a ZipApp."""
-    # TODO: change the API so the same `Builder` can be reused
-    with builder.prepare(src = Path.cwd(), dst = Path.cwd() / 'dist') as b:
-        b.zipapp(zipapp_main)
+    If `archive` is None, the most recently built ZipApp in `./dist` is used.
+    Returns a `bork.startup.Profile` for the ZipApp, and one for the baseline (or None).
+    """
+    if archive is None:
+        built = sorted(Path.cwd().glob('dist/*.pyz'), key=lambda p: p.stat().st_mtime)
+        if not built:
+            raise RuntimeError("No ZipApp found in 'dist/', build one with `bork build --zipapp`")
+        archive = built[-1]
+
+    for path in (archive, baseline):
+        if path is not None and not Path(path).is_file():
+            raise RuntimeError(f"No such ZipApp: '{path}'")
+
+    profile = startup.profile(Path(archive), runs=runs, args=args)
+    if baseline is None:
+        return profile, None
+
+    return profile, startup.profile(Path(baseline), runs=runs, args=args)
 
 
 def clean():
@@ -101,7 +135,8 @@ def download(package, release_tag, file_pattern, directory):
     download(package, release_tag, file_pattern, directory) # type:ignore
 
 
-def release(repository_name, dry_run, github_release_override=None, pypi_release_override=None):
+def release(repository_name, dry_run, github_release_override=None, pypi_release_override=None,
+            skip_existing=False):
     """Uploads build artifacts to a PyPi instance or GitHub, as configured
     in pyproject.toml.
 
@@ -119,9 +154,18 @@ def release(repository_name, dry_run, github_release_override=None, pypi_release
         py_release_override:
             If True, enable PyPi releases; if False, disable PyPi releases;
             if None, respect the configuration in pyproject.toml.
+
+        skip_existing:
+            If True, don't upload files which are already on the PyPi repository,
+            such as when retrying a release which failed part-way.
+
+    Releasing to PyPi and preparing the GitHub release happen concurrently, so files may
+    be published on PyPi even if preparing the GitHub release fails; if either fails, the
+    first error is raised (and any other logged), and the GitHub release isn't published.
     """
-    from . import github, pypi
+    from . import github, http, pypi
     config = Config.from_project(Path.cwd())
+    http.set_retry_policy(http.RetryPolicy(**asdict(config.bork.release.retry)))
     credentials = Credentials.from_env()
 
     try:
@@ -155,16 +199,37 @@ def release(repository_name, dry_run, github_release_override=None, pypi_release
             globs = config.bork.release.github_release_globs,
             dry_run = dry_run,
             strip_zipapp_version = config.bork.release.strip_zipapp_version,
+            upload_workers = config.bork.release.upload_workers,
         )
-        github_release.prepare()
 
-    if release_to_pypi:
-        pypi.upload(repository_name, './dist/*.tar.gz', './dist/*.whl',
-                    dry_run=dry_run)
+    # Releasing to GitHub (fetching the changelog, creating a draft release and uploading
+    # its assets) and to PyPi (resolving credentials and uploading files) happen concurrently.
+    # Only publishing the GitHub release waits for both to have succeeded: PyPi uploads
+    # can't be undone, but a failed GitHub release is resumed by releasing again.
+    with ThreadPoolExecutor() as pool:
+        pipelines = []
+        if release_to_github:
+            pipelines.append(pool.submit(github_release.prepare))
+        if release_to_pypi:
+            pipelines.append(pool.submit(
+                pypi.upload, repository_name, './dist/*.tar.gz', './dist/*.whl',
+                dry_run=dry_run, workers=config.bork.release.upload_workers,
+                skip_existing=skip_existing,
+            ))
+
+    errors = [e for e in (p.exception() for p in pipelines) if e is not None]
+    for error in errors[1:]:
+        logger().error(error)
+    if errors:
+        raise errors[0]
 
     if release_to_github:
         github_release.publish()
 
+    retries, wait = http.retry_stats()
+    if retries:
+        logger().info("Retried %d failed requests, waiting %.1fs in total.", retries, wait)
+
 
 def run(alias):
     """Run the alias specified by `alias`, as defined in pyproject.toml."""
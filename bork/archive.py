@@ -0,0 +1,226 @@
+"""Bork's zip archive writer
+
+Unlike :py:mod:`zipfile`, this writer can copy members from existing archives
+without decompressing and recompressing them, which makes it possible to assemble
+archives (such as zipapps) from other archives (such as wheels) cheaply.
+
+An archive is written from a sequence of :py:class:`Entry`, which are
+either compressed from data (:py:meth:`Entry.from_bytes`) or copied as-is
+from another archive (:py:meth:`Entry.from_zip`).
+As :py:mod:`zlib` releases the GIL, entries can be compressed concurrently
+while keeping their order; see :py:func:`concurrently`.
+
+For archives to be reproducible, entries should be written in a fixed order,
+and :py:func:`normalized` to not depend on when and where their contents were created.
+"""
+
+from collections import deque
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, replace
+from pathlib import Path
+from typing import BinaryIO
+import os, struct, time, zipfile, zlib
+
+
+_LOCAL_HEADER = struct.Struct("<IHHHHHIIIHH")
+_CENTRAL_HEADER = struct.Struct("<IHHHHHHIIIHHHHHII")
+_END_OF_CENTRAL_DIR = struct.Struct("<IHHHHIIH")
+
+_LOCAL_SIGNATURE = 0x04034b50
+_CENTRAL_SIGNATURE = 0x02014b50
+_END_SIGNATURE = 0x06054b50
+
+_VERSION = 20                    # Zip 2.0: deflate, directories
+_MADE_BY = (3 << 8) | _VERSION   # Unix, so external attributes hold permissions
+_UTF8 = 1 << 11
+
+_ZIP32_MAX = 0xFFFFFFFF
+_ZIP32_MAX_MEMBERS = 0xFFFF
+
+_ZIP_EPOCH = 315532800  # 1980-01-01, the earliest time representable in zip archives
+
+DateTime = tuple[int, int, int, int, int, int]
+
+
+@dataclass(frozen = True, kw_only = True)
+class Entry:
+    """A member of an archive, ready to be written"""
+    name: str
+    data: bytes          # Possibly-compressed contents
+    method: int          # zipfile.ZIP_STORED or zipfile.ZIP_DEFLATED
+    crc: int
+    size: int            # Uncompressed size
+    date_time: DateTime
+    mode: int = 0o644
+
+    def contents(self) -> bytes:
+        """The entry's uncompressed contents."""
+        if self.method == zipfile.ZIP_DEFLATED:
+            return zlib.decompress(self.data, -15)
+        return self.data
+
+    @classmethod
+    def from_bytes(cls, name: str, data: bytes, *, date_time: DateTime | None = None,
+                   mode: int = 0o644, compresslevel: int = 6) -> 'Entry':
+        """Create an entry from uncompressed data, deflating it if it makes it smaller.
+
+        :param compresslevel: The :py:mod:`zlib` compression level; ``0`` stores the data as-is.
+        """
+        compressed = b""
+        if compresslevel:
+            deflate = zlib.compressobj(compresslevel, zlib.DEFLATED, -15)
+            compressed = deflate.compress(data) + deflate.flush()
+
+        stored = not compresslevel or len(compressed) >= len(data)
+        return cls(
+            name = name,
+            data = data if stored else compressed,
+            method = zipfile.ZIP_STORED if stored else zipfile.ZIP_DEFLATED,
+            crc = zlib.crc32(data),
+            size = len(data),
+            date_time = date_time or time.localtime()[:6],
+            mode = mode,
+        )
+
+    @classmethod
+    def from_zip(cls, fp: BinaryIO, info: zipfile.ZipInfo, *, name: str | None = None) -> 'Entry':
+        """Copy a member of an existing archive, without recompressing it.
+
+        :param fp: The archive, opened in binary mode.
+        :param info: The member to copy, as listed by :py:class:`zipfile.ZipFile`.
+        :param name: The member's name in the new archive, if it differs.
+        """
+        if info.compress_type not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+            raise ValueError(f"Unsupported compression method for '{info.filename}'")
+
+        if info.flag_bits & 0x1:
+            raise ValueError(f"Encrypted member '{info.filename}'")
+
+        fp.seek(info.header_offset)
+        header = _LOCAL_HEADER.unpack(fp.read(_LOCAL_HEADER.size))
+        if header[0] != _LOCAL_SIGNATURE:
+            raise ValueError(f"Bad local header for '{info.filename}'")
+
+        name_length, extra_length = header[-2:]
+        fp.seek(name_length + extra_length, os.SEEK_CUR)
+
+        return cls(
+            name = name or info.filename,
+            data = fp.read(info.compress_size),
+            method = info.compress_type,
+            crc = info.CRC,
+            size = info.file_size,
+            date_time = info.date_time,
+            mode = (info.external_attr >> 16) & 0o7777 or 0o644,
+        )
+
+
+def concurrently(entries: Iterable[Entry | Callable[[], Entry | None]], *,
+                 workers: int | None = None) -> Iterator[Entry]:
+    """Produce entries in a thread pool, keeping them in order.
+
+    :param entries: Entries, or callables producing an entry (or ``None`` to skip it),
+                    such as a call to :py:meth:`Entry.from_bytes`.
+    :param workers: The number of threads, by default one per CPU.
+    """
+    workers = workers or os.cpu_count() or 1
+    with ThreadPoolExecutor(workers) as pool:
+        # Bound how many entries are held in memory, ahead of being written
+        window: deque[Entry | Future[Entry | None]] = deque()
+
+        def results(until: int) -> Iterator[Entry]:
+            while len(window) > until:
+                item = window.popleft()
+                entry = item.result() if isinstance(item, Future) else item
+                if entry is not None:
+                    yield entry
+
+        for entry in entries:
+            window.append(pool.submit(entry) if callable(entry) else entry)
+            yield from results(4 * workers)
+
+        yield from results(0)
+
+
+def source_date_epoch() -> DateTime:
+    """The time which reproducible archives' entries are dated with.
+
+    It is ``$SOURCE_DATE_EPOCH`` if set (see https://reproducible-builds.org/specs/source-date-epoch/),
+    or else the earliest time representable in a zip archive.
+    """
+    epoch = int(os.environ.get("SOURCE_DATE_EPOCH", _ZIP_EPOCH))
+    return time.gmtime(max(epoch, _ZIP_EPOCH))[:6]
+
+
+def normalized(entries: Iterable[Entry], *, date_time: DateTime | None = None) -> Iterator[Entry]:
+    """Give entries the same date, and permissions which only depend on whether they are executable.
+
+    :param date_time: By default, :py:func:`source_date_epoch`.
+    """
+    date_time = date_time or source_date_epoch()
+    for entry in entries:
+        yield replace(entry, date_time = date_time, mode = 0o755 if entry.mode & 0o111 else 0o644)
+
+
+def _dos_date_time(date_time: DateTime) -> tuple[int, int]:
+    year, month, day, hour, minute, second = date_time
+    year = min(max(year, 1980), 2107)
+    return (
+        (hour << 11) | (minute << 5) | (second // 2),
+        ((year - 1980) << 9) | (month << 5) | day,
+    )
+
+
+def write(path: Path, entries: Iterable[Entry], *, prefix: bytes = b"") -> None:
+    """Write an archive, with entries in the order given.
+
+    :param prefix: Data written before the archive itself, such as a zipapp's shebang line.
+    :raises ValueError: if an entry is too large, or there are too many of them, as ZIP64
+                        is not supported; or if an entry is duplicated.
+    """
+    central: list[bytes] = []
+    names = set()
+
+    with path.open("wb") as f:
+        f.write(prefix)
+
+        for entry in entries:
+            if entry.name in names:
+                raise ValueError(f"Duplicate archive member '{entry.name}'")
+            names.add(entry.name)
+
+            offset = f.tell()
+            if max(offset, entry.size, len(entry.data)) > _ZIP32_MAX:
+                raise ValueError(f"Archive member '{entry.name}' is too large")
+            if len(central) >= _ZIP32_MAX_MEMBERS:
+                raise ValueError(f"Too many archive members, at most {_ZIP32_MAX_MEMBERS} are supported")
+
+            name = entry.name.encode("utf-8")
+            flags = 0 if name.isascii() else _UTF8
+            dos_time, dos_date = _dos_date_time(entry.date_time)
+
+            f.write(_LOCAL_HEADER.pack(
+                _LOCAL_SIGNATURE, _VERSION, flags, entry.method, dos_time, dos_date,
+                entry.crc, len(entry.data), entry.size, len(name), 0,
+            ))
+            f.write(name)
+            f.write(entry.data)
+
+            is_dir = entry.name.endswith("/")
+            mode = entry.mode | (0o040000 if is_dir else 0o100000)
+            central.append(_CENTRAL_HEADER.pack(
+                _CENTRAL_SIGNATURE, _MADE_BY, _VERSION, flags, entry.method, dos_time, dos_date,
+                entry.crc, len(entry.data), entry.size, len(name), 0, 0, 0, 0,
+                (mode << 16) | (0x10 if is_dir else 0), offset,
+            ) + name)
+
+        start = f.tell()
+        for header in central:
+            f.write(header)
+        if f.tell() > _ZIP32_MAX:
+            raise ValueError("Archive is too large")
+
+        f.write(_END_OF_CENTRAL_DIR.pack(
+            _END_SIGNATURE, 0, 0, len(central), len(central), f.tell() - start, start, 0,
+        ))
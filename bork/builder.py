@@ -19,8 +19,9 @@ Example
 """""""
 .. code:: python
 with bork.builder.prepare(src_dir, artefacts_dir) as b:
+    b.build("sdist")
     b.build("wheel")
-    b.zipapp()
+    b.zipapp()  # reuses the wheel
 
     meta = b.metadata()
     with (artefacts_dir / f"{meta['name']}-{meta['version']}.json").open("w") as meta_file:
@@ -34,20 +35,24 @@ with bork.builder.prepare(src_dir, artefacts_dir) as b:
 .. _wheel: https://packaging.python.org/en/latest/glossary/#term-Wheel
 """
 
+from . import pyz
 from .config import Config
+from .env import IsolatedEnv, isolated, normalize
+from .filesystem import copy_sources, dist_metadata, fingerprint, unpack_sdist
 from .log import logger
+from .version import __version__
 
 import build
 
 from abc import ABC, abstractmethod
 from collections.abc import Iterator, Sequence
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
-from dataclasses import dataclass
+from dataclasses import asdict, dataclass, field
 from pathlib import Path
 from tempfile import TemporaryDirectory
-from typing import Literal, Mapping
-import importlib, importlib.metadata
-import subprocess, sys, zipapp
+from typing import Any, Literal, Mapping, cast
+import hashlib, importlib, importlib.metadata, importlib.util, json, os
 
 
 # The "proper" way to handle the default would be to check python_requires
@@ -58,10 +63,75 @@ DEFAULT_PYTHON_INTERPRETER = '/usr/bin/env python3'
 DistributionKind = Literal["sdist", "wheel"]
 BuildSettings = Mapping[str, str | Sequence[str]]
 
+
+def _jsonable(x: Any) -> Any:
+    return json.loads(json.dumps(x, sort_keys = True, default = sorted))
+
+def _sha256(path: Path) -> str:
+    with path.open("rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+
+@dataclass
+class Manifest:
+    """Record of the artefacts in a directory, and of what they were built from
+
+    It is stored alongside the artefacts, and used to skip building artefacts which
+    would be identical to existing ones: an artefact is only reused if it was built
+    by the same version of Bork, from a source tree with the same fingerprint,
+    with the same build requirements and settings, and it was not modified since.
+    """
+    path: Path
+    key: Mapping[str, Any]
+    artefacts: dict[str, dict[str, Any]] = field(default_factory = dict)
+
+    FILENAME = ".bork-manifest.json"
+
+    @classmethod
+    def load(cls, dst: Path, key: Mapping[str, Any]) -> 'Manifest':
+        path, key = dst / cls.FILENAME, _jsonable(key)
+        try:
+            data = json.loads(path.read_text(encoding = "utf-8"))
+            if data["key"] == key:
+                return cls(path, key, data["artefacts"])
+        except (FileNotFoundError, ValueError, KeyError):
+            pass
+
+        return cls(path, key)
+
+    def get(self, kind: str, settings: Mapping[str, Any]) -> Path | None:
+        """Get an up-to-date artefact, if any."""
+        entry = self.artefacts.get(kind)
+        if entry is None or entry["settings"] != _jsonable(settings):
+            return None
+
+        artefact = self.path.parent / entry["name"]
+        if not artefact.is_file() or _sha256(artefact) != entry["sha256"]:
+            return None
+
+        return artefact
+
+    def record(self, kind: str, settings: Mapping[str, Any], artefact: Path) -> str:
+        """Record an artefact, and return its SHA-256 digest."""
+        self.artefacts[kind] = {
+            "name": artefact.name,
+            "settings": _jsonable(settings),
+            "sha256": _sha256(artefact),
+        }
+
+        self.path.parent.mkdir(parents = True, exist_ok = True)
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        tmp.write_text(json.dumps({"key": self.key, "artefacts": self.artefacts}, indent = 2), encoding = "utf-8")
+        tmp.replace(self.path)
+        return self.artefacts[kind]["sha256"]
+
 class Builder(ABC):
     @abstractmethod
     def metadata(self) -> importlib.metadata.PackageMetadata:
-        "Build the package's wheel metadata"
+        """Build the package's wheel metadata
+
+        Metadata is only rebuilt if the source tree changed since it was last built.
+        """
 
     @abstractmethod
     def build(self, dist: DistributionKind, *, settings: BuildSettings = {}) -> Path:
@@ -72,99 +142,265 @@ class Builder(ABC):
         :returns: The :py:class:`pathlib.Path` to the built artefact.
         """
 
+    @abstractmethod
+    def build_all(self, *, parallel: bool = False, from_sdist: bool = False) -> Mapping[DistributionKind, Path]:
+        """Build both the sdist and the wheel of the package
+
+        :param parallel: Run the backend's sdist and wheel hooks concurrently.
+                         The wheel is then built from a private copy of the source tree,
+                         so backends which write into the source tree cannot race each other
+                         (see :py:func:`bork.filesystem.copy_sources`).
+        :param from_sdist: Build the wheel from the unpacked sdist, rather than the source tree.
+                           As the sdist must be built first, this is never done concurrently,
+                           even if `parallel` is set.
+
+        Artefacts which are up-to-date are reused, as with :py:meth:`build`.
+        :returns: A mapping from distribution kinds to the built artefacts.
+        """
+
     @abstractmethod
     def zipapp(self, main: str | None) -> Path:
         """Build a :py:mod:`zipapp` containing the package and its runtime dependencies
 
         :param main: The name of a callable used as the zipapp's entry point.
                      It must be in the form ``"pkg.mod:func"``, or ``None``
-                     in which case the source tree must contain a ``__main__.py``;
-                     see :py:func:`zipapp.create_archive`.
+                     in which case the package must contain a top-level ``__main__.py``.
         :returns: The :py:class:`pathlib.Path` to the executable archive.
+
+        If a wheel was already built by this :py:class:`Builder`, it is reused.
+        """
+
+    @abstractmethod
+    def zipapps(self, main: str | None = None) -> list[Path]:
+        """Build all the zipapps configured for the package, in one pass
+
+        Those are the zipapps listed in ``[tool.bork.zipapp.targets]``, and the package's own
+        zipapp, as built by :py:meth:`zipapp`, if there are no targets or if ``main`` is set
+        (either as a parameter, or in the configuration).
+        Members which are common to several zipapps are only compressed once.
+
+        :returns: The :py:class:`pathlib.Path` to each executable archive.
         """
 
 
 @contextmanager
-def prepare(src: Path, dst: Path) -> Iterator[Builder]:
+def prepare(src: Path, dst: Path, *, cache: bool = True) -> Iterator[Builder]:
     """Context manager for performing builds in an isolated environments.
 
     :param src: The :py:class:`pathlib.Path` of the source tree to be built.
     :param dst: The :py:class:`pathlib.Path` to the directory where to store built artefacts.
                 It will be created if it does not yet exist.
+    :param cache: If false, build in a fresh isolated environment, rather than reusing
+                  one from Bork's cache (see :py:mod:`bork.env`), and always rebuild
+                  artefacts, even if they are up-to-date according to the :py:class:`Manifest`.
     :returns: A concrete :py:class:`Builder`
     """
     @dataclass(frozen = True)
     class Bob(Builder):
         src: Path
         dst: Path
-        env: build.env.IsolatedEnv
+        env: IsolatedEnv
         bld: build.ProjectBuilder
+        tmp: Path
+        manifest: Manifest
+        built: dict[DistributionKind, Path] = field(default_factory = dict)
+        # Metadata directories, by fingerprint of the source tree they were built from
+        _metadata: dict[str, Path] = field(default_factory = dict)
+        # Whether to reuse parts of previously-built artefacts
+        incremental: bool = True
 
         def metadata_path(self) -> Path:
+            fp = fingerprint(self.src, exclude = (self.dst, ))
+            if fp in self._metadata:
+                return self._metadata[fp]
+
             logger().info("Building wheel metadata")
 
-            out_dir = Path(env.path) / 'metadata'
-            out_dir.mkdir(exist_ok = True)
-            return Path(self.bld.metadata_path(out_dir))
+            out_dir = self.tmp / 'metadata' / fp
+            out_dir.mkdir(parents = True, exist_ok = True)
+            self._metadata[fp] = Path(self.bld.metadata_path(out_dir))
+            return self._metadata[fp]
 
         def metadata(self) -> importlib.metadata.PackageMetadata:
             return importlib.metadata.PathDistribution(
                 self.metadata_path()
             ).metadata
 
+        def _up_to_date(self, dist, settings) -> Path | None:
+            if artefact := self.manifest.get(dist, settings):
+                logger().info(f"Reusing up-to-date {dist} '{artefact}'")
+                self.built[dist] = artefact
+            return artefact
+
+        def _record(self, dist, settings, artefact: Path) -> Path:
+            self.built[dist] = artefact
+            self.manifest.record(dist, settings, artefact)
+            return artefact
+
+        def _install_requires(self, bld: build.ProjectBuilder, dists, settings) -> None:
+            self.env.install(self.env.missing({
+                req for dist in dists for req in bld.get_requires_for_build(dist, settings)
+            }))
+
         def build(self, dist, *, settings = {}):
+            if artefact := self._up_to_date(dist, settings):
+                return artefact
+
             logger().info(f"Building {dist}")
-            self.env.install(
-                self.bld.get_requires_for_build(dist, settings)
-            )
-            # TODO: reuse metadata_path if it was already built
-            return Path( self.bld.build(dist, self.dst, settings) )
+            self._install_requires(self.bld, (dist, ), settings)
+
+            # Reuse the wheel metadata, if it was built from the current source tree
+            metadata_dir = None
+            if dist == "wheel" and not settings and self._metadata:
+                fp = fingerprint(self.src, exclude = (self.dst, ))
+                if fp in self._metadata:
+                    metadata_dir = self._metadata[fp]
+
+            return self._record(dist, settings, Path(self.bld.build(dist, self.dst, settings, metadata_dir)))
+
+        def build_all(self, *, parallel = False, from_sdist = False):
+            log = logger()
+            # Wheels built from the sdist are recorded separately in the manifest
+            wheel_settings = {"bork:from-sdist": True} if from_sdist else {}
+
+            sdist = self._up_to_date("sdist", {})
+            wheel = self._up_to_date("wheel", wheel_settings)
+            if wheel or not (parallel or from_sdist):
+                return {"sdist": sdist or self.build("sdist"), "wheel": wheel or self.build("wheel")}
+
+            if from_sdist:
+                # The wheel can only be built once the sdist is, so nothing runs concurrently.
+                if parallel:
+                    log.info("Building the wheel from the sdist, so not concurrently")
+                sdist = sdist or self.build("sdist")
+                wheel_bld = build.ProjectBuilder.from_isolated_env(
+                    self.env, unpack_sdist(sdist, self.tmp / "sdist"),
+                )
+                self._install_requires(wheel_bld, ("wheel", ), {})
+                log.info(f"Building wheel from '{wheel_bld.source_dir}'")
+                wheel = self._record("wheel", wheel_settings, Path(wheel_bld.build("wheel", self.dst)))
+                return {"sdist": sdist, "wheel": wheel}
+
+            try:
+                copy_sources(self.src, self.tmp / "src", exclude = (self.dst, ))
+            except ValueError as e:
+                log.warning(f"Building the sdist and wheel sequentially: {e}")
+                return {"sdist": sdist or self.build("sdist"), "wheel": self.build("wheel")}
+            wheel_bld = build.ProjectBuilder.from_isolated_env(self.env, self.tmp / "src")
+
+            # Requirements are installed upfront, so the env is never modified concurrently
+            if not sdist:
+                self._install_requires(self.bld, ("sdist", ), {})
+            self._install_requires(wheel_bld, ("wheel", ), {})
+
+            with ThreadPoolExecutor(max_workers = 1) as pool:
+                log.info(f"Building wheel from '{wheel_bld.source_dir}'")
+                wheel_job = pool.submit(wheel_bld.build, "wheel", self.dst)
+
+                if not sdist:
+                    log.info("Building sdist")
+                    sdist = self._record("sdist", {}, Path(self.bld.build("sdist", self.dst)))
+
+                wheel = self._record("wheel", wheel_settings, Path(wheel_job.result()))
+
+            return {"sdist": sdist, "wheel": wheel}
 
         def zipapp(self, main):
+            return self._zipapps(main, named = False)[0]
+
+        def zipapps(self, main = None):
+            return self._zipapps(main, named = True)
+
+        def _zipapps(self, main: str | None, *, named: bool) -> list[Path]:
             log = logger()
-            log.info("Building zipapp")
 
             log.debug("Loading configuration")
             config = Config.from_project(self.src)
+            main = main or config.bork.zipapp.main
+
+            # Entry point and interpreter, by target name; None is the package's own zipapp.
+            targets: dict[str | None, tuple[str | None, str]] = {}
+            if not named or main or not config.bork.zipapp.targets:
+                targets[None] = (main, config.bork.python_interpreter)
+            if named:
+                for target_name, target in config.bork.zipapp.targets.items():
+                    targets[target_name] = (target.main, target.python_interpreter or config.bork.python_interpreter)
+
+            # mypy does not see through the config's partially-applied dataclass decorator
+            common = asdict(config.bork.zipapp)  # type: ignore[call-overload]
+            if epoch := os.environ.get("SOURCE_DATE_EPOCH"):
+                common["source_date_epoch"] = epoch  # Members are dated with it
+            if config.bork.zipapp.bytecode is not None:
+                # Bytecode is specific to the Python version it was compiled by
+                common["bytecode_magic"] = importlib.util.MAGIC_NUMBER.hex()
+
+            def kind(name: str | None) -> str:
+                return "zipapp" if name is None else f"zipapp:{name}"
+
+            def settings(name: str | None) -> dict[str, Any]:
+                main, interpreter = targets[name]
+                return {**common, "main": main, "python_interpreter": interpreter}
+
+            up_to_date = [self.manifest.get(kind(name), settings(name)) for name in targets]
+            if all(up_to_date):
+                for artefact in up_to_date:
+                    log.info(f"Reusing up-to-date zipapp '{artefact}'")
+                return cast(list[Path], up_to_date)
+
+            log.info("Building zipapp" + ("s" if len(targets) > 1 else ""))
+            wheel = self.built.get("wheel") or self.build("wheel")
 
             log.debug("Loading metadata")
-            meta = self.metadata()
-            dst = self.dst / f"{meta['name']}-{meta['version']}.pyz"
-
-            with TemporaryDirectory() as tmp:
-                # Install the wheel we just built, including all dependencies
-                wheel = self.build("wheel")
-
-                log.info(f"Installing '{wheel}'")
-                subprocess.check_call((
-                    sys.executable, '-m', 'pip', 'install',
-                    '--target', tmp,
-                    wheel
-                ))
-
-                log.info(f"Creating zipapp archive '{dst}'")
-                zipapp.create_archive(
-                    source = tmp,
-                    target = dst,
-                    interpreter = config.bork.python_interpreter,
-                    main = main or config.bork.zipapp.main,  # TODO error if main is None and there's no __main__.py
-                    compressed = True,
+            meta = dist_metadata(wheel)
+            dsts = {
+                name: self.dst / f"{name or meta['name']}-{meta['version']}.pyz"
+                for name in targets
+            }
+
+            lock_file = self.src / config.bork.zipapp.lock_file if config.bork.zipapp.lock_file \
+                else self.dst / ".bork-zipapp.lock"
+            pins = pyz.lock_dependencies(wheel, lock_file)
+
+            with pyz.dependencies(pins) as deps:
+                log.info("Creating zipapp archive%s %s", "s" if len(targets) > 1 else "",
+                         ", ".join(f"'{dst}'" for dst in dsts.values()))
+                pyz.assemble_many(
+                    [pyz.Target(dsts[name], *targets[name]) for name in targets],
+                    [*deps, wheel],
+                    optimize = config.bork.zipapp.bytecode,
+                    checked_hash = config.bork.zipapp.bytecode_invalidation == "checked-hash",
+                    include = config.bork.zipapp.include,
+                    exclude = config.bork.zipapp.exclude,
+                    strip = config.bork.zipapp.strip,
+                    shake = config.bork.zipapp.shake,
+                    compresslevel = config.bork.zipapp.compression_level,
+                    store = config.bork.zipapp.store,
+                    index = self.dst / ".bork-zipapp-index.json" if self.incremental else None,
                 )
 
-            if not dst.exists():
-                raise RuntimeError(f"Failed to build zipapp: {dst}")
+            for name, dst in dsts.items():
+                if not dst.exists():
+                    raise RuntimeError(f"Failed to build zipapp: {dst}")
+
+                digest = self.manifest.record(kind(name), settings(name), dst)
+                log.info(f"Zipapp '{dst}' successfully built, with SHA-256 digest {digest}")
 
-            log.info(f"Zipapp '{dst}' successfully built")
-            return dst
+            return list(dsts.values())
 
 
     src, dst = src.resolve(), dst.resolve()
 
-    with build.env.DefaultIsolatedEnv() as env:
-        builder = build.ProjectBuilder.from_isolated_env(env, src)
-        env.install(builder.build_system_requires)
+    requires = build.ProjectBuilder(src).build_system_requires
+    key = {
+        "bork": __version__,
+        "fingerprint": fingerprint(src, exclude = (dst, )),
+        "requires": normalize(requires),
+    }
+    manifest = Manifest.load(dst, key) if cache else Manifest(dst / Manifest.FILENAME, _jsonable(key))
 
-        yield Bob(src, dst, env, builder)
+    with isolated(requires, cached = cache) as env, TemporaryDirectory(prefix = "bork-") as tmp:
+        builder = build.ProjectBuilder.from_isolated_env(env, src)
+        yield Bob(src, dst, env, builder, Path(tmp), manifest, incremental = cache)
 
 
 # TODO: remove last caller (api.release)
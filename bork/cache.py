@@ -0,0 +1,211 @@
+"""Bork's on-disk, per-user cache
+
+Cached data lives under a single root directory, which is ``$BORK_CACHE_DIR``
+if set, or else a ``bork`` directory in the platform's usual cache location.
+
+Entries in a cache directory are meant to be shared between concurrent Bork
+processes on the same host, so they should be guarded by a :py:class:`FileLock`:
+shared while an entry is being used, exclusive while it is being created,
+modified, or evicted.
+"""
+
+from .log import logger
+
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from pathlib import Path
+import os, shutil, sys, time
+
+
+def root() -> Path:
+    """The root of Bork's cache directory."""
+    if path := os.environ.get("BORK_CACHE_DIR"):
+        return Path(path)
+
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA") or Path.home() / "AppData" / "Local"
+    elif sys.platform == "darwin":
+        base = Path.home() / "Library" / "Caches"
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+
+    return Path(base) / "bork"
+
+
+def cache_dir(*parts: str) -> Path:
+    """Get a subdirectory of Bork's cache, creating it if needed."""
+    path = root().joinpath(*parts)
+    path.mkdir(parents = True, exist_ok = True)
+    return path
+
+
+class FileLock:
+    """An advisory, inter-process lock backed by a file.
+
+    On Windows, shared locks are not supported and are silently made exclusive.
+
+    Usage:
+        with FileLock(path / "entry.lock"):
+            ...
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._fd: int | None = None
+        self._shared = False
+
+    @property
+    def locked(self) -> bool:
+        return self._fd is not None
+
+    def acquire(self, *, shared: bool = False, blocking: bool = True) -> bool:
+        """Acquire the lock, or convert an already-held lock to another mode.
+
+        :returns: ``False`` if ``blocking`` is false and the lock is held elsewhere.
+        """
+        if self._fd is None:
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        elif sys.platform == "win32" or shared == self._shared:
+            return True
+
+        try:
+            if sys.platform == "win32":
+                import msvcrt
+                while True:
+                    try:
+                        msvcrt.locking(self._fd, msvcrt.LK_NBLCK, 1)
+                        break
+                    except OSError:
+                        if not blocking:
+                            raise BlockingIOError from None
+                        time.sleep(0.1)
+            else:
+                import fcntl
+                mode = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+                fcntl.flock(self._fd, mode if blocking else mode | fcntl.LOCK_NB)
+
+        except BlockingIOError:
+            self.release()
+            return False
+
+        self._shared = shared
+        return True
+
+    def release(self) -> None:
+        if self._fd is None:
+            return
+
+        if sys.platform == "win32":
+            import msvcrt
+            try:
+                msvcrt.locking(self._fd, msvcrt.LK_UNLCK, 1)
+            except OSError:
+                pass  # The lock was never acquired
+
+        os.close(self._fd)  # On POSIX, this drops the lock too
+        self._fd = None
+
+    def __enter__(self) -> 'FileLock':
+        self.acquire()
+        return self
+
+    def __exit__(self, *_exc) -> None:
+        self.release()
+
+
+def lock_for(entry: Path) -> FileLock:
+    """The lock guarding a given cache entry."""
+    return FileLock(entry.with_name(entry.name + ".lock"))
+
+
+def _ready(entry: Path) -> Path:
+    return entry.with_name(entry.name + ".ready")
+
+
+def touch(entry: Path) -> None:
+    """Mark a cache entry as recently used."""
+    os.utime(entry)
+
+
+@contextmanager
+def entry(directory: Path, key: str, populate: Callable[[Path], None], *,
+          max_entries: int | None = None, max_bytes: int | None = None) -> Iterator[tuple[Path, FileLock]]:
+    """Context manager providing a cache entry, creating it if needed.
+
+    The entry is a directory, named ``key``, which ``populate`` is called to fill.
+    While the context is active, the entry is held under a shared lock;
+    callers which modify it must acquire the (yielded) lock exclusively.
+    When a new entry is created, least-recently used entries are evicted;
+    see :py:func:`evict`.
+    """
+    path = directory / key
+    lock, ready = lock_for(path), _ready(path)
+
+    created = False
+    try:
+        # Check for a ready entry under a shared lock, so concurrent processes can use it.
+        lock.acquire(shared = True)
+        if not ready.exists():
+            lock.acquire(shared = False)
+            if not ready.exists():  # Another process might have created it meanwhile
+                shutil.rmtree(path, ignore_errors = True)  # Remove any partially-created entry
+                path.mkdir()
+                populate(path)
+                ready.touch()
+                created = True
+            lock.acquire(shared = True)
+
+        touch(path)
+        yield path, lock
+
+    finally:
+        lock.release()
+        if created:  # Only check the eviction policy when the cache grows
+            evict(directory, max_entries = max_entries, max_bytes = max_bytes)
+
+
+def _size(path: Path) -> int:
+    return sum(
+        (Path(dirpath) / f).lstat().st_size
+        for dirpath, _, files in os.walk(path)
+        for f in files
+    )
+
+
+def _entries(directory: Path) -> Iterator[tuple[float, Path]]:
+    for entry in directory.iterdir():
+        if entry.is_dir():
+            yield entry.stat().st_mtime, entry
+
+
+def evict(directory: Path, *, max_entries: int | None = None, max_bytes: int | None = None) -> None:
+    """Remove least-recently used entries from a cache directory.
+
+    Entries are evicted until there are at most ``max_entries`` of them,
+    and they use at most ``max_bytes`` of storage in total.
+    Entries which are currently locked are skipped.
+    """
+    log = logger()
+    entries = [e for _, e in sorted(_entries(directory), reverse = True)]
+    sizes = {e: _size(e) for e in entries} if max_bytes is not None else {}
+
+    kept, total = 0, 0
+    for entry in entries:
+        size = sizes.get(entry, 0)
+        within_budget = (
+            (max_entries is None or kept < max_entries) and
+            (max_bytes is None or total + size <= max_bytes)
+        )
+
+        if not within_budget:
+            lock = lock_for(entry)
+            if lock.acquire(blocking = False):
+                try:
+                    log.debug(f"Evicting '{entry}' from the cache")
+                    _ready(entry).unlink(missing_ok = True)
+                    shutil.rmtree(entry, ignore_errors = True)
+                    continue
+                finally:
+                    lock.release()
+
+        kept, total = kept + 1, total + size
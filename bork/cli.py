@@ -15,10 +15,10 @@ Options that exist for all commands include:
 """
 
 from pathlib import Path
-import argparse, inspect, logging, sys
+import argparse, inspect, logging, shlex, sys
 
 from . import __version__
-from . import api
+from . import api, startup
 from .config import Config
 from .log import logger
 
@@ -40,15 +40,33 @@ def aliases(_args):
 
 def build(args):
     """
-    ### `bork build`
+    ### `bork build [--zipapp | --no-zipapp] [--zipapp-main=MAIN] [--no-cache] [--parallel] [--wheel-from-sdist]`
 
     Build the project.
-    """
-    api.build()
 
+    Arguments:
+        --zipapp, --no-zipapp:
+            Always, or never, build a zipapp; by default, as configured in
+            pyproject.toml.
+
+        --zipapp-main=MAIN:
+            Entrypoint for the zipapp, as `module.submodule:function`.
+
+        --no-cache:
+            Build in a fresh isolated environment, instead of a cached one,
+            and rebuild artefacts even if they are up-to-date.
+
+        --parallel:
+            Build the sdist and wheel concurrently.
+
+        --wheel-from-sdist:
+            Build the wheel from the sdist (once built), instead of the source tree.
+    """
     config = Config.from_project(Path.cwd())
-    if args.zipapp or config.bork.zipapp.enabled:
-        api.build_zipapp(args.zipapp_main)
+    zipapp = args.zipapp if args.zipapp is not None else config.bork.zipapp.enabled
+
+    api.build(cache=args.cache, zipapp=zipapp, zipapp_main=args.zipapp_main,
+              parallel=args.parallel, wheel_from_sdist=args.wheel_from_sdist)
 
 
 def clean(_args):
@@ -95,7 +113,7 @@ def download(args):
 
 def release(args):
     """
-    ### `bork release [--pypi-repository=REPO | --test-pypi] [--dry-run]`
+    ### `bork release [--pypi-repository=REPO | --test-pypi] [--skip-existing] [--dry-run]`
 
     Arguments:
         --pypi-repository=REPO:
@@ -106,13 +124,16 @@ def release(args):
         --test-pypi:
             Equivalent to `--pypi-repository testpypi`
 
+        --skip-existing:
+            Don't upload files which are already on the PyPi repository.
+
         --dry-run:
             Don't actually release, just show what a release would do.
     """
     pypi_repository = args.pypi_repository
     if args.test_pypi:
         pypi_repository = 'testpypi'
-    api.release(pypi_repository, args.dry_run, args.github, args.pypi)
+    api.release(pypi_repository, args.dry_run, args.github, args.pypi, args.skip_existing)
 
 
 def run(args):
@@ -124,6 +145,43 @@ def run(args):
     api.run(args.ALIAS)
 
 
+def zipapp_profile(args):
+    """
+    ### `bork zipapp-profile [--runs=N] [--args=ARGS] [--top=N] [--baseline=BASELINE [--max-regression=PERCENT]] [ARCHIVE]`
+
+    Measure how fast a ZipApp starts, by running it several times,
+    and report which modules take the longest to import.
+
+    Arguments:
+        --runs=N:
+            (default `10`)
+            How many times to run the ZipApp, each in a fresh interpreter.
+        --args=ARGS:
+            (default `--help`)
+            Arguments passed to the ZipApp, which should make it exit quickly.
+        --top=N:
+            (default `20`)
+            How many modules to report.
+        --baseline=BASELINE:
+            Another ZipApp (such as a previous release) to compare against.
+        --max-regression=PERCENT:
+            Fail if the ZipApp starts more than PERCENT % slower than the baseline.
+        ARCHIVE:
+            (default: the most recently built ZipApp in `dist/`)
+            The ZipApp to measure.
+    """
+    profile, baseline = api.zipapp_profile(args.ARCHIVE, args.baseline, args.runs, shlex.split(args.args))
+
+    if baseline is None:
+        print(startup.report(profile, top=args.top))
+        return
+
+    print(startup.compare(profile, baseline, top=args.top))
+    regression = startup.regression(profile, baseline)
+    if args.max_regression is not None and regression * 100 > args.max_regression:
+        raise RuntimeError(f"'{profile.archive}' starts {regression:.1%} slower than '{baseline.archive}'")
+
+
 def _arg_parser():
     parser = argparse.ArgumentParser(
             prog="bork",
@@ -148,6 +206,12 @@ def _arg_parser():
     buildp.add_argument("--zipapp-main", action="store",
                         help="Entrypoint for the ZipApp. Format is: module.submodule:function")
     buildp.set_defaults(zipapp_main=None)
+    buildp.add_argument("--no-cache", dest="cache", action="store_false",
+                        help="Build in a fresh isolated environment, instead of a cached one.")
+    buildp.add_argument("--parallel", action="store_true",
+                        help="Build the sdist and wheel concurrently.")
+    buildp.add_argument("--wheel-from-sdist", action="store_true",
+                        help="Build the wheel from the sdist (once built), instead of the source tree.")
 
     cleanp = subparsers.add_parser("clean", help="Remove files generated by `bork build`.")
     cleanp.set_defaults(func=clean)
@@ -176,6 +240,8 @@ def _arg_parser():
     releasep.add_argument("--test-pypi", action="store_true",
                          help="Release to test.pypi.org instead of pypi.org.\n"
                               "Equivalent to '--pypi-repository testpypi'.")
+    releasep.add_argument("--skip-existing", action="store_true",
+                         help="Don't upload files which are already on the PyPi repository.")
     releasep.add_argument("--dry-run", action="store_true",
                          help="Don't actually release, just show what a release would do.")
 
@@ -197,6 +263,21 @@ def _arg_parser():
     runp.add_argument("ALIAS")
     runp.set_defaults(func=run)
 
+    profilep = subparsers.add_parser("zipapp-profile", help="Measure how fast a ZipApp starts.")
+    profilep.add_argument("--runs", type=int, default=10,
+                          help="How many times to run the ZipApp. (Default: 10)")
+    profilep.add_argument("--args", default="--help",
+                          help="Arguments passed to the ZipApp, such as `--args=--version`. (Default: `--help`)")
+    profilep.add_argument("--top", type=int, default=20,
+                          help="How many modules to report. (Default: 20)")
+    profilep.add_argument("--baseline",
+                          help="Another ZipApp to compare against.")
+    profilep.add_argument("--max-regression", type=float, metavar="PERCENT",
+                          help="Fail if the ZipApp starts more than PERCENT %% slower than the baseline.")
+    profilep.add_argument("ARCHIVE", nargs="?",
+                          help="The ZipApp to measure. (Default: the latest one in `dist/`)")
+    profilep.set_defaults(func=zipapp_profile)
+
     return parser
 
 
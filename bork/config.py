@@ -2,9 +2,9 @@ from collections.abc import Mapping, Set, Sequence
 from functools import partial, reduce
 from pathlib import Path
 import tomllib
-from typing import Annotated, Optional # after Py3.10, replace string annotations with Self
+from typing import Annotated, Literal, Optional # after Py3.10, replace string annotations with Self
 
-from pydantic import dataclasses, BeforeValidator, TypeAdapter
+from pydantic import dataclasses, BeforeValidator, Field, TypeAdapter
 
 
 # TODO(nicoo): tie model definitions into CLI parsing
@@ -12,6 +12,14 @@ from pydantic import dataclasses, BeforeValidator, TypeAdapter
 # Ensure we don't accidentally make non-frozen or non-kw-only dataclasses
 dataclass = partial(dataclasses.dataclass, frozen = True, kw_only = True)
 
+@dataclass
+class RetryConfig:
+    # See bork.http.RetryPolicy
+    retries: Annotated[int, Field(ge = 0)] = 5
+    backoff: Annotated[float, Field(ge = 0)] = 1.0
+    max_backoff: Annotated[float, Field(ge = 0)] = 60.0
+    max_wait: Annotated[float, Field(ge = 0)] = 600.0
+
 @dataclass
 class ReleaseConfig:
     # Related CLI flags: dry_run, pypi_repository
@@ -22,12 +30,53 @@ class ReleaseConfig:
     pypi: bool = True
     strip_zipapp_version: bool = False
 
+    # How many files are uploaded concurrently.
+    upload_workers: Annotated[int, Field(ge = 1)] = 4
+
+    # How failed requests, to PyPI and GitHub, are retried.
+    retry: RetryConfig = RetryConfig()
+
+@dataclass
+class ZipappTarget:
+    main: str
+    python_interpreter: Optional[str] = None  # Defaults to ToolConfig.python_interpreter
+
 @dataclass
 class ZipappConfig:
     enabled: bool = False        # args.zipapp
     main: Optional[str] = None   # args.zipapp_main
     # TODO(nicoo): specify entrypoint format w/ regex annotation
 
+    # Additional zipapps, built from the same wheels, and named `{name}-{version}.pyz`
+    # If set, the package's own zipapp is only built if `main` is set.
+    targets: Mapping[str, ZipappTarget] = dataclasses.Field(default_factory = dict)
+
+    # Where runtime dependencies are pinned, relative to the project root
+    # If unset, they are pinned in the artefacts directory, which `bork clean` removes.
+    lock_file: Optional[str] = None
+
+    # Optimization level (0, 1 or 2) of bytecode precompiled into the zipapp, if any
+    # Bytecode targets the Python version running Bork; other versions ignore it.
+    bytecode: Optional[Literal[0, 1, 2]] = None
+    # Whether imports check bytecode against its source ("checked-hash") or not ("unchecked-hash")
+    bytecode_invalidation: Literal["checked-hash", "unchecked-hash"] = "checked-hash"
+
+    # Glob patterns of files to leave out of the zipapp, and of files to keep regardless
+    exclude: Set[str] = frozenset()
+    include: Set[str] = frozenset()
+    # Kinds of files to leave out of the zipapp; see bork.pyz.STRIP_PROFILES
+    strip: Set[Literal["tests", "stubs", "docs"]] = frozenset()
+    # Leave out top-level packages which `main` never imports, directly or not
+    shake: bool = False
+
+    # Compression level (0-9) of files which are not already compressed in wheels
+    compression_level: Annotated[int, Field(ge = 0, le = 9)] = 6
+    # File extensions of files which are stored uncompressed, typically as they are compressed already
+    store: Set[str] = frozenset((
+        ".gz", ".bz2", ".xz", ".zip", ".whl", ".jar",
+        ".png", ".jpg", ".jpeg", ".gif", ".webp", ".woff", ".woff2",
+    ))
+
 
 Commands = Annotated[
     Sequence[str],
@@ -0,0 +1,160 @@
+"""Isolated build environments
+
+:py:func:`isolated` provides a virtual environment with a package's build requirements installed.
+By default, environments are kept in Bork's cache (see :py:mod:`bork.cache`), keyed by the
+normalized set of requirements and by the Python interpreter, so that building projects
+with the same build requirements does not require recreating an identical environment.
+"""
+
+from . import cache
+from .log import logger
+
+import build.env
+from packaging.requirements import Requirement
+from packaging.utils import canonicalize_name
+
+from collections.abc import Collection, Iterator
+from contextlib import contextmanager
+from pathlib import Path
+from tempfile import TemporaryDirectory
+import hashlib, importlib.metadata, json, os, subprocess, sys, sysconfig, venv
+
+
+# Bump whenever the layout of cached environments changes.
+ENV_FORMAT = 2
+
+# Eviction policy for cached environments
+MAX_ENVS = 8
+MAX_BYTES = 2 * 1024 ** 3
+
+
+class IsolatedEnv(build.env.IsolatedEnv):
+    """A virtual environment used to run a build backend
+
+    Requirements are installed using the pip from Bork's own environment.
+    """
+
+    def __init__(self, path: Path, lock: cache.FileLock | None = None):
+        self.path = path
+        self.lock = lock
+
+    def _path(self, name: str) -> Path:
+        return Path(sysconfig.get_path(name, "venv", vars = {"base": self.path, "platbase": self.path}))
+
+    @property
+    def scripts_dir(self) -> Path:
+        return self._path("scripts")
+
+    @property
+    def python_executable(self) -> str:
+        return str(self.scripts_dir / ("python.exe" if os.name == "nt" else "python"))
+
+    def make_extra_environ(self) -> dict[str, str]:
+        path = os.environ.get("PATH")
+        return {
+            "PATH": os.pathsep.join((str(self.scripts_dir), path)) if path else str(self.scripts_dir)
+        }
+
+    def create(self) -> None:
+        logger().info(f"Creating isolated environment in '{self.path}'")
+        venv.EnvBuilder(symlinks = os.name != "nt", with_pip = False).create(self.path)
+
+    def missing(self, requirements: Collection[str]) -> list[str]:
+        """Filter out the requirements which are already satisfied in the environment."""
+        dists = {
+            canonicalize_name(d.metadata["Name"]): d
+            for d in importlib.metadata.distributions(
+                path = list(map(str, {self._path("purelib"), self._path("platlib")}))
+            )
+        }
+
+        # The environment runs the same interpreter as Bork, so markers can be evaluated here.
+        def satisfied(req: Requirement, extra: str = "") -> bool:
+            if req.marker and not req.marker.evaluate({"extra": extra}):
+                return True
+
+            dist = dists.get(canonicalize_name(req.name))
+            if dist is None or not req.specifier.contains(dist.version, prereleases = True):
+                return False
+
+            return all(
+                satisfied(Requirement(dep), extra)
+                for extra in req.extras
+                for dep in dist.requires or ()
+            )
+
+        return [r for r in requirements if not satisfied(Requirement(r))]
+
+    def install(self, requirements: Collection[str]) -> None:
+        """Install requirements in the environment."""
+        if not requirements:
+            return
+
+        if self.lock:
+            # Modifying a shared environment requires exclusive access
+            self.lock.acquire(shared = False)
+
+        try:
+            logger().info("Installing %s", ", ".join(sorted(requirements)))
+            subprocess.check_call((
+                sys.executable, '-m', 'pip',
+                '--python', self.python_executable,
+                'install', '--no-warn-script-location',
+                *requirements,
+            ))
+        finally:
+            if self.lock:
+                self.lock.acquire(shared = True)
+
+
+def normalize(requirements: Collection[str]) -> list[str]:
+    """Normalize a set of PEP 508 requirements, for use as a cache key."""
+    def norm(s: str) -> str:
+        req = Requirement(s)
+        req.name = canonicalize_name(req.name)
+        req.extras = set(map(canonicalize_name, req.extras))
+        return str(req)
+
+    return sorted(set(map(norm, requirements)))
+
+
+def env_key(requirements: Collection[str]) -> str:
+    """The cache key of an environment, for the current Python interpreter."""
+    key = json.dumps({
+        "format": ENV_FORMAT,
+        "requirements": normalize(requirements),
+        "python": {
+            "executable": os.path.realpath(sys.executable),
+            "version": sys.version,
+            "platform": sysconfig.get_platform(),
+        },
+    }, sort_keys = True)
+
+    return hashlib.sha256(key.encode()).hexdigest()[:32]
+
+
+@contextmanager
+def isolated(requirements: Collection[str], *, cached: bool = True) -> Iterator[IsolatedEnv]:
+    """Context manager providing an isolated environment with the given requirements installed.
+
+    :param requirements: The PEP 508 requirements to install in the environment.
+    :param cached: If false, the environment is created from scratch and discarded afterwards,
+                   instead of being reused from (and stored in) Bork's cache.
+    """
+    if not cached:
+        with TemporaryDirectory(prefix = "bork-env-") as tmp:
+            env = IsolatedEnv(Path(tmp).resolve())
+            env.create()
+            env.install(requirements)
+            yield env
+        return
+
+    def populate(path: Path) -> None:
+        env = IsolatedEnv(path)
+        env.create()
+        env.install(requirements)
+
+    with cache.entry(cache.cache_dir("envs"), env_key(requirements), populate,
+                     max_entries = MAX_ENVS, max_bytes = MAX_BYTES) as (path, lock):
+        logger().info(f"Using isolated environment '{path}'")
+        yield IsolatedEnv(path, lock)
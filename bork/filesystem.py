@@ -1,6 +1,13 @@
-from pathlib import Path
-import shutil
+from collections.abc import Iterable
+from pathlib import Path, PurePosixPath
+import hashlib
+import importlib.metadata
+import os
 import re
+import shutil
+import subprocess
+import tarfile
+import zipfile
 
 
 def find_files(globs):
@@ -25,3 +32,224 @@ _WHEEL_FILENAME_REGEX = re.compile(
 )
 def wheel_file_info(path):
     return re.match(_WHEEL_FILENAME_REGEX, Path(path).name).groupdict()
+
+
+class _ArchivedDistribution(importlib.metadata.Distribution):
+    """A distribution whose metadata was read from a built artefact"""
+    def __init__(self, metadata: str):
+        self._metadata = metadata
+
+    def read_text(self, filename):
+        return self._metadata if filename in ("METADATA", "PKG-INFO") else None
+
+    def locate_file(self, path):
+        # Built artefacts aren't installed, so files are located within the archive.
+        return PurePosixPath(path)
+
+
+def dist_metadata(path) -> importlib.metadata.PackageMetadata:
+    """Read the core metadata of a built wheel or sdist, without building anything."""
+    path = Path(path)
+
+    if path.name.endswith(".whl"):
+        with zipfile.ZipFile(path) as whl:
+            name = next(
+                n for n in whl.namelist()
+                if n.count("/") == 1 and n.endswith(".dist-info/METADATA")
+            )
+            metadata = whl.read(name)
+
+    elif path.name.endswith(".tar.gz"):
+        with tarfile.open(path, "r:gz") as sdist:
+            member = next(
+                m for m in sdist.getmembers()
+                if m.isfile() and m.name.count("/") == 1 and m.name.endswith("/PKG-INFO")
+            )
+            metadata = sdist.extractfile(member).read()  # type: ignore
+
+    else:
+        raise ValueError(f"'{path}' is neither a wheel nor an sdist")
+
+    return _ArchivedDistribution(metadata.decode("utf-8")).metadata
+
+
+# Paths produced by builds or tools, which are not part of a source tree
+_NOT_SOURCES = re.compile(r"^(\..*|__pycache__|.*\.egg-info)$")
+_NOT_SOURCES_TOPLEVEL = re.compile(r"^(build|dist)$")
+
+def _is_source(rel: PurePosixPath) -> bool:
+    return not (
+        any(_NOT_SOURCES.match(part) for part in rel.parts) or
+        (len(rel.parts) > 1 and _NOT_SOURCES_TOPLEVEL.match(rel.parts[0]))
+    )
+
+
+_VCS_DIRS = frozenset((".git", ".hg", ".svn"))
+
+def copy_sources(src: Path, dst: Path, exclude: Iterable[Path] = ()) -> Path:
+    """Copy a source tree, omitting build outputs, hidden directories and any paths in `exclude`.
+
+    In a git working tree, exactly the files git knows of (tracked, or untracked but not ignored)
+    are copied instead, so the copy has the same status as the source tree: backends which
+    derive versions from git must not see it as modified.
+    VCS metadata is symlinked rather than copied, where supported,
+    so backends which derive versions from it keep working.
+
+    :raises ValueError: If `src` is a subdirectory of a git working tree, as git
+                        would see the copy as missing every other file.
+    """
+    src, dst = src.resolve(), dst.resolve()
+    exclude = {p.resolve() for p in exclude}
+
+    if (files := _git_files(src)) is not None:
+        dst.mkdir(parents = True)
+        for name in files:
+            path = src / name
+            if path in exclude or any(p in exclude for p in path.parents) or not os.path.lexists(path):
+                continue  # Files deleted from the working tree are also missing from the copy
+            (dst / name).parent.mkdir(parents = True, exist_ok = True)
+            if path.is_dir() and not path.is_symlink():  # A submodule
+                shutil.copytree(path, dst / name, symlinks = True)
+            else:
+                shutil.copy2(path, dst / name, follow_symlinks = False)
+
+    else:
+        def ignore(dirpath, names):
+            rel = PurePosixPath(Path(dirpath).relative_to(src).as_posix())
+            return {
+                name for name in names
+                if Path(dirpath, name) in exclude
+                or (Path(dirpath, name).is_dir() and not _is_source(rel / name / "_"))
+            }
+
+        shutil.copytree(src, dst, ignore = ignore, symlinks = True)
+
+    for name in _VCS_DIRS:
+        if (src / name).exists():
+            try:
+                (dst / name).symlink_to(src / name, target_is_directory = (src / name).is_dir())
+            except OSError:
+                if (src / name).is_dir():
+                    shutil.copytree(src / name, dst / name, symlinks = True)
+                else:
+                    shutil.copy2(src / name, dst / name)
+
+    return dst
+
+
+def unpack_sdist(sdist: Path, dst: Path) -> Path:
+    """Unpack an sdist, returning the path to its top-level directory."""
+    with tarfile.open(sdist, "r:gz") as tar:
+        top = {PurePosixPath(name).parts[0] for name in tar.getnames()}
+        if len(top) != 1:
+            raise RuntimeError(f"'{sdist}' does not contain a single top-level directory")
+
+        if hasattr(tarfile, "data_filter"):
+            tar.extractall(dst, filter = "data")
+        else:  # Python < 3.11.4
+            tar.extractall(dst)
+
+    return dst / top.pop()
+
+
+def _git(src: Path, *args: str) -> str:
+    return subprocess.run(
+        ('git', '--no-optional-locks', *args),
+        cwd = src, check = True, capture_output = True, text = True,
+    ).stdout
+
+
+def _git_files(src: Path) -> list[str] | None:
+    """The files git knows of in a working tree, or None if `src` isn't in one."""
+    try:
+        if _git(src, 'rev-parse', '--is-inside-work-tree').strip() != "true":
+            return None
+        root = Path(_git(src, 'rev-parse', '--show-toplevel').strip()).resolve()
+        files = _git(src, 'ls-files', '-z', '--cached', '--others', '--exclude-standard')
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+    if root != src:
+        raise ValueError(f"'{src}' is a subdirectory of the git working tree '{root}'")
+    return [name for name in dict.fromkeys(files.split("\0")) if name]
+
+
+def _git_fingerprint(src: Path, excluded) -> str | None:
+    """Fingerprint a source tree using the git index, so unmodified files need not be read."""
+    try:
+        if _git(src, 'rev-parse', '--is-inside-work-tree').strip() != "true":
+            return None
+        root = Path(_git(src, 'rev-parse', '--show-toplevel').strip()).resolve()
+        index = _git(src, 'ls-files', '--stage', '-z', '--', '.')
+        status = _git(src, 'status', '--porcelain=v1', '-z', '--untracked-files=all', '--no-renames', '--', '.')
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+    # Backends such as setuptools-scm and hatch-vcs derive versions from the current commit and tags,
+    # so committing or tagging changes what is built, even though no file changed.
+    try:
+        revision = _git(src, 'rev-parse', 'HEAD') + _git(src, 'describe', '--tags', '--always', '--dirty')
+    except subprocess.CalledProcessError:
+        revision = ""  # No commits yet
+
+    digest = hashlib.sha256(f"{revision}\0{index}".encode())
+
+    # Files modified since they were staged, or untracked, must be hashed
+    for entry in status.split("\0"):
+        if not entry:
+            continue
+
+        state, path = entry[:2], root / entry[3:]
+        if state[1] == " ":
+            continue  # Unmodified in the working tree, so already accounted for by the index
+        if state == "??" and (not _is_source(PurePosixPath(path.relative_to(src).as_posix())) or excluded(path)):
+            continue
+
+        digest.update(f"{entry}\0".encode())
+        if path.is_file():
+            with path.open("rb") as f:
+                digest.update(hashlib.file_digest(f, "sha256").digest())
+
+    return digest.hexdigest()
+
+
+def _stat_fingerprint(src: Path, excluded) -> str:
+    """Fingerprint a source tree by walking it, using each file's size and modification time."""
+    digest = hashlib.sha256()
+
+    for dirpath, dirnames, filenames in os.walk(src):
+        rel = PurePosixPath(Path(dirpath).relative_to(src).as_posix())
+        dirnames[:] = sorted(
+            d for d in dirnames
+            if _is_source(rel / d / "_") and not excluded(Path(dirpath, d))
+        )
+
+        for name in sorted(filenames):
+            path = Path(dirpath, name)
+            if not _is_source(rel / name) or excluded(path):
+                continue
+
+            stat = path.stat()
+            digest.update(f"{(rel / name).as_posix()}\0{stat.st_size}\0{stat.st_mtime_ns}\0".encode())
+
+    return digest.hexdigest()
+
+
+def fingerprint(src: Path, exclude: Iterable[Path] = ()) -> str:
+    """Compute a fingerprint of a source tree, which changes whenever a file is modified.
+
+    In a git working tree, the fingerprint is derived from the current commit and tags,
+    from the index, and from the contents of modified and untracked files;
+    files ignored by git are not considered.
+    Otherwise, it is derived from the size and modification time of every file.
+
+    Either way, hidden files, ``__pycache__``, ``*.egg-info``, and the top-level ``build``
+    and ``dist`` directories are ignored, as are any paths in `exclude`.
+    """
+    src = src.resolve()
+    exclude = [p.resolve() for p in exclude]
+
+    def excluded(path: Path) -> bool:
+        return any(path == e or e in path.parents for e in exclude)
+
+    return _git_fingerprint(src, excluded) or _stat_fingerprint(src, excluded)
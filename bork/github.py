@@ -24,7 +24,8 @@ class GithubRelease:  # pylint: disable=too-many-instance-attributes
     def __init__(self, config: GithubConfig,
                  tag: str, commitish: Optional[str] = None,
                  body: Optional[str] = None, globs=None,
-                 dry_run=False, prerelease=None, strip_zipapp_version=False):
+                 dry_run=False, prerelease=None, strip_zipapp_version=False,
+                 upload_workers=None):
         self.log = logger()
 
         self.owner = config.owner
@@ -47,6 +48,7 @@ class GithubRelease:  # pylint: disable=too-many-instance-attributes
 
         self.dry_run = dry_run
         self.strip_zipapp_version = strip_zipapp_version
+        self.upload_workers = upload_workers
 
         self.github = None
         self.release = None
@@ -74,13 +76,17 @@ class GithubRelease:  # pylint: disable=too-many-instance-attributes
         if self.dry_run:
             self.log.warning(
                 'Skipping creating draft GitHub release since this is a dry run.')
+            # Preview the changelog, which is cached for when actually releasing.
+            if self.token and (self.body is None or 'changelog' in self.body):
+                github = GithubApi(self.owner, self.repo, self.project_name, self.token)
+                self.log.info('Changelog:\n%s', github.changelog())
             return
 
         self.github = GithubApi(self.owner, self.repo, self.project_name, self.token)
         self.release = self.github.create_release(
             self.tag_name, commitish=self.commitish, body=self.body,
             draft=True, prerelease=self.prerelease,
-            assets=self.assets)
+            assets=self.assets, workers=self.upload_workers)
 
     def publish(self):
         if self.dry_run:
@@ -1,13 +1,44 @@
-import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
+import hashlib
+import json
 import subprocess
-import urllib.request
+import time
+from urllib.parse import quote
 
 import packaging.version
 
+from . import cache, http
 from .log import logger
 
 
+# Bump whenever the format of cached changelogs changes.
+CHANGELOG_FORMAT = 1
+
+# How many changelogs are kept in the cache
+MAX_CHANGELOGS = 16
+
+# GitHub's search API lists at most 1000 results, in pages of up to 100.
+SEARCH_MAX_RESULTS = 1000
+SEARCH_PAGE_SIZE = 100
+
+
+def _mib(size):
+    return f"{size / 1024 ** 2:.1f} MiB"
+
+
+def _sha256(file):
+    with Path(file).open('rb') as f:
+        return hashlib.file_digest(f, 'sha256').hexdigest()
+
+
+class _IncompleteChangelog(Exception):
+    """Raised to avoid caching a changelog which may be missing some pull requests"""
+    def __init__(self, changelog):
+        super().__init__(changelog)
+        self.changelog = changelog
+
+
 class GithubApi:
     """
     Basic wrapper for the GitHub API.
@@ -17,6 +48,14 @@ class GithubApi:
         gh.create_release('TEST-RELEASE', assets={'dist/bork-4.0.5.pyz': 'bork.pyz'})
     """
 
+    API_URL = 'https://api.github.com'
+
+    # How many assets are uploaded concurrently, by default.
+    WORKERS = 4
+
+    # How often the progress of uploading an asset is logged, in seconds.
+    PROGRESS_INTERVAL = 5
+
     def __init__(self, owner, repo, project_name, token):
         self.owner = owner
         self.repo = repo
@@ -30,7 +69,7 @@ class GithubApi:
 
     # pylint: disable=too-many-arguments,too-many-locals
     def create_release(self, tag_name, name=None, commitish=None, body=None, draft=True,
-                       prerelease=None, assets=None, note=None):
+                       prerelease=None, assets=None, note=None, workers=None):
         """
         `tag_name` is the name of the tag.
         `commitish` is a commit hash, branch, tag, etc.
@@ -39,6 +78,12 @@ class GithubApi:
         `prerelease` indicates whether it should be a prerelease or not.
         `assets` is a dict mapping local file paths to the uploaded asset name.
         `note` is a note which is by default inserted right before the changelog.
+        `workers` is how many assets are uploaded at once, by default `WORKERS`.
+
+        If `draft` is true and a draft release for `tag_name` already exists, such as
+        when a previous release was interrupted, it is reused rather than creating
+        another: it is updated if it differs (for instance, if it targets another
+        commit), and only the assets missing from it, or which differ, are uploaded.
         """
         if commitish is None:
             commitish = self.run('git', 'rev-parse', 'HEAD')
@@ -65,9 +110,6 @@ class GithubApi:
         if note is not None:
             note = f"\n{note}\n"
 
-        logger().info('Creating GitHub release %s%s. (commit=%s)', tag_name,
-                      draft_indicator, commitish)
-
         if prerelease is None:
             prerelease = packaging.version.parse(tag_name).is_prerelease
 
@@ -93,91 +135,268 @@ class GithubApi:
             'draft': draft,
             'prerelease': prerelease,
         }
+
+        if draft and (release := self.find_draft_release(tag_name)) is not None:
+            logger().info('Resuming draft GitHub release %s. (%s)', tag_name, release['html_url'])
+            # The draft may have been created from another commit, or with another changelog.
+            changed = {key: value for key, value in request.items() if release.get(key) != value}
+            if changed:
+                logger().info('Updating draft GitHub release %s: %s. (commit=%s)', tag_name,
+                              ', '.join(changed), commitish)
+                release = self._api_patch(f"/repos/{self.owner}/{self.repo}/releases/{release['id']}",
+                                          changed)
+            if assets:
+                self.upload_assets(release, self.missing_assets(release, assets), workers=workers)
+            return release
+
+        logger().info('Creating GitHub release %s%s. (commit=%s)', tag_name,
+                      draft_indicator, commitish)
+
         url = f"/repos/{self.owner}/{self.repo}/releases"
         response = self._api_post(url, request)
 
-        upload_url = response['upload_url'].split('{?')[0]
-
         if assets:
-            for local_file, asset_name in assets.items():
-                self.add_release_asset(upload_url, local_file, asset_name)
+            self.upload_assets(response, assets, workers=workers)
 
         return response
     # pylint: enable=too-many-arguments,too-many-locals
 
     def changelog(self):
-        prs = self._api_get(f'/repos/{self.owner}/{self.repo}/pulls?state=closed')
-        prs = filter(self._relevant_to_changelog, prs)
-        summaries = map(self._format_for_changelog, prs)
-        return "\n".join(summaries)
+        """
+        List the pull requests merged since the last release, formatted for release notes.
+
+        Changelogs are cached (see `bork.cache`), per repository and commit, so preparing
+        the same release again (such as after a dry run) doesn't query GitHub again.
+        Changelogs which may be incomplete (when the search timed out, or found too many
+        pull requests to list them all) aren't cached.
+        """
+        try:
+            commit = self.run('git', 'rev-parse', 'HEAD')
+        except (OSError, subprocess.CalledProcessError):
+            return self._fetch_changelog()[0]
+
+        key = json.dumps({
+            'format': CHANGELOG_FORMAT,
+            'repository': f'{self.owner}/{self.repo}',
+            'commit': commit,
+        }, sort_keys=True)
+
+        def populate(path):
+            changelog, complete = self._fetch_changelog()
+            if not complete:  # Don't cache it, so releasing again queries GitHub again
+                raise _IncompleteChangelog(changelog)
+            (path / 'changelog.md').write_text(changelog, encoding='utf-8')
+
+        try:
+            with cache.entry(cache.cache_dir('changelogs'), hashlib.sha256(key.encode()).hexdigest()[:32],
+                             populate, max_entries=MAX_CHANGELOGS) as (path, _):
+                return (path / 'changelog.md').read_text(encoding='utf-8')
+        except _IncompleteChangelog as e:
+            return e.changelog
+
+    def _fetch_changelog(self):
+        """Fetch the changelog, and whether it lists every pull request merged since the last release."""
+        last_release = self.last_release
+        since = last_release['created_at'] if last_release else None
+        pulls, complete = self._search_merged_pull_requests(since)
+        return "\n".join(map(self._format_for_changelog, pulls)), complete
 
     @staticmethod
     def _format_for_changelog(pr):
         return f'* {pr["title"]} (#{pr["number"]} by @{pr["user"]["login"]})'
 
-    def _relevant_to_changelog(self, pr):
-        if not pr or not pr['merged_at']:
-            return False
+    def merged_pull_requests(self, since=None):
+        """
+        List the pull requests merged after `since` (an ISO 8601 date), or ever, newest first.
+
+        They are found with GitHub's search API, whose pages (after the first one, which
+        says how many there are) are fetched concurrently.
+        """
+        return self._search_merged_pull_requests(since)[0]
+
+    def _search_merged_pull_requests(self, since):
+        """List the pull requests merged after `since`, and whether the list is complete."""
+        log = logger()
+        query = f'repo:{self.owner}/{self.repo} is:pr is:merged'
+        if since is not None:
+            query += f' merged:>{since}'
+
+        def page(number):
+            return self._api_get(f'/search/issues?q={quote(query)}&sort=created&order=desc'
+                                 f'&per_page={SEARCH_PAGE_SIZE}&page={number}')
+
+        first = page(1)
+        total = first['total_count']
+        if total > SEARCH_MAX_RESULTS:
+            log.warning('%d pull requests were merged since the last release, but only the '
+                        '%d most recent can be listed.', total, SEARCH_MAX_RESULTS)
 
-        if pr['merged_at'] > self.last_release['created_at']:
-            return True
+        pages = -(-min(total, SEARCH_MAX_RESULTS) // SEARCH_PAGE_SIZE)
+        with ThreadPoolExecutor(self.WORKERS) as pool:
+            results = [first, *pool.map(page, range(2, pages + 1))]
 
-        return False
+        incomplete = any(result['incomplete_results'] for result in results)
+        if incomplete:
+            log.warning("GitHub's search timed out, so the changelog may be incomplete.")
+
+        pulls = [pr for result in results for pr in result['items']]
+        return pulls, not incomplete and total <= SEARCH_MAX_RESULTS
 
     @property
     def last_release(self):
+        """The latest release which isn't a draft, or None if there's none."""
         if not self._last_release:
-            self._last_release = self._api_get(
-                f'/repos/{self.owner}/{self.repo}/releases')[0]
+            # Drafts, such as the release being prepared, aren't released yet.
+            self._last_release = next(
+                (r for r in self._api_get(f'/repos/{self.owner}/{self.repo}/releases')
+                 if not r['draft']),
+                None,
+            )
         return self._last_release
 
-    def add_release_asset(self, upload_url, local_file, name):
-        logger().info('Adding asset %s to release (original file: %s).',
-                      name, local_file)
+    def find_draft_release(self, tag_name):
+        """Find a draft release for `tag_name`, if there is one."""
+        # Drafts can't be looked up by tag, but releases are listed newest first,
+        # so a draft left by a recent attempt at releasing is on the first page.
+        releases = self._api_get(f'/repos/{self.owner}/{self.repo}/releases?per_page=100')
+        return next((r for r in releases if r['draft'] and r['tag_name'] == tag_name), None)
 
-        data = Path(local_file).read_bytes()
+    def missing_assets(self, release, assets):
+        """
+        Filter `assets` (a dict mapping local file paths to asset names), keeping those
+        which still need uploading to `release`.
 
-        headers = {
-            'Content-Type': 'application/octet-stream',
-        }
+        Assets already uploaded are compared by size, and by SHA-256 digest when GitHub
+        provides it; those which differ, or whose upload didn't complete, are deleted.
+        """
+        log = logger()
+        uploaded = {asset['name']: asset for asset in self.release_assets(release)}
+
+        missing = {}
+        for local_file, name in assets.items():
+            asset = uploaded.get(name)
+            if asset is None:
+                missing[local_file] = name
+                continue
+
+            digest = asset.get('digest') or ''
+            if asset['state'] == 'uploaded' \
+                    and asset['size'] == Path(local_file).stat().st_size \
+                    and (not digest.startswith('sha256:') or digest[7:] == _sha256(local_file)):
+                log.info('Asset %s was already uploaded.', name)
+                continue
+
+            log.info('Replacing asset %s, which differs from %s.', name, local_file)
+            self._api_delete(f"/repos/{self.owner}/{self.repo}/releases/assets/{asset['id']}")
+            missing[local_file] = name
+
+        return missing
+
+    def upload_assets(self, release, assets, workers=None):
+        """
+        Upload assets to `release`, concurrently.
+
+        `assets` is a dict mapping local file paths to the uploaded asset name.
+        `workers` is how many assets are uploaded at once, by default `WORKERS`.
+        """
+        if not assets:
+            return
+
+        failed = []
+        with ThreadPoolExecutor(workers or self.WORKERS) as pool:
+            futures = {
+                pool.submit(self.add_release_asset, release, local_file, asset_name): asset_name
+                for local_file, asset_name in assets.items()
+            }
+            for future in as_completed(futures):
+                if (error := future.exception()) is not None:
+                    logger().error('Failed to upload asset %s: %s', futures[future], error)
+                    failed.append(futures[future])
+
+        if failed:
+            raise RuntimeError(f"Failed to upload {len(failed)} of {len(assets)} assets "
+                               f"to the GitHub release: {', '.join(sorted(failed))}")
+
+    def add_release_asset(self, release, local_file, name):
+        """
+        Upload a file as an asset of `release`, streaming it from disk.
 
-        url = f"{upload_url}?name={name}"
-        response = self._api_post(url, data, headers=headers, server='')
+        Uploads which fail transiently (a dropped connection, or a server error) are
+        retried, according to the retry policy of `bork.http`, after deleting whatever
+        was left of the asset by the failed upload.
+        """
+        log = logger()
+        log.info('Adding asset %s to release (original file: %s).',
+                 name, local_file)
+
+        upload_url = release['upload_url'].split('{?')[0]
+        url = f"{upload_url}?name={quote(name)}"
+        size = Path(local_file).stat().st_size
+        start = last_logged = time.monotonic()
+
+        def progress(sent):
+            nonlocal last_logged
+            now = time.monotonic()
+            if sent < size and now - last_logged >= self.PROGRESS_INTERVAL:
+                last_logged = now
+                log.info('Uploading asset %s: %d%% (%s of %s, %s/s)', name, 100 * sent // size,
+                         _mib(sent), _mib(size), _mib(sent / (now - start)))
+
+        def retrying():
+            # GitHub rejects uploading an asset which already exists, even partially.
+            nonlocal start, last_logged
+            self.delete_release_asset(release, name)
+            start = last_logged = time.monotonic()
+
+        # Retrying is harmless, as the asset left by a failed upload is deleted first.
+        response = self._api_post(url, http.FileBody(Path(local_file), progress), server='',
+                                  idempotent=True, on_retry=retrying)
+
+        elapsed = max(time.monotonic() - start, 1e-3)
+        log.info('Uploaded asset %s: %s in %.1fs (%s/s)', name, _mib(size), elapsed, _mib(size / elapsed))
         return response
 
+    def release_assets(self, release):
+        """List the assets of `release`."""
+        return self._api_get(
+            f"/repos/{self.owner}/{self.repo}/releases/{release['id']}/assets?per_page=100")
+
+    def delete_release_asset(self, release, name):
+        """Delete the asset of `release` with the given name, if there is one."""
+        for asset in self.release_assets(release):
+            if asset['name'] == name:
+                logger().info('Deleting asset %s from release.', name)
+                self._api_delete(f"/repos/{self.owner}/{self.repo}/releases/assets/{asset['id']}")
+
     @staticmethod
     def run(*command):
         return subprocess.check_output(command).decode().strip()
 
     # pylint: disable=too-many-arguments
 
-    def _api_req(self, endpoint, data, headers, server, method):
+    def _api_req(self, endpoint, data, headers, server, method, **kwargs):
         if headers is None:
             headers = {}
         if server is None:
-            server = 'https://api.github.com'
+            server = self.API_URL
 
         headers['Authorization'] = f'token {self.token}'
         headers['Accept'] = 'application/vnd.github.v3+json'
 
-        if isinstance(data, (dict, list)):
-            data = json.dumps(data).encode()
-
-        req = urllib.request.Request(server + endpoint, data=data,
-                                     headers=headers, method=method)
-        logger().debug('%s %s', req.method, req.full_url)
-
-        with urllib.request.urlopen(req) as f:
-            response = f.read().decode()
-        return json.loads(response)
+        logger().debug('%s %s', method, server + endpoint)
+        response = http.request(method, server + endpoint, body=data, headers=headers, **kwargs)
+        return response.json() if response.data else None
 
     # pylint: enable=too-many-arguments
 
-    def _api_post(self, endpoint, data, headers=None, server=None):
-        return self._api_req(endpoint, data, headers, server, 'POST')
+    def _api_post(self, endpoint, data, headers=None, server=None, **kwargs):
+        return self._api_req(endpoint, data, headers, server, 'POST', **kwargs)
 
     def _api_get(self, endpoint, headers=None, server=None):
         return self._api_req(endpoint, None, headers, server, 'GET')
 
     def _api_patch(self, endpoint, data, headers=None, server=None):
         return self._api_req(endpoint, data, headers, server, 'PATCH')
+
+    def _api_delete(self, endpoint, headers=None, server=None):
+        return self._api_req(endpoint, None, headers, server, 'DELETE')
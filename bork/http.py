@@ -1,24 +1,302 @@
-#import urllib.request
+"""Bork's HTTP client
+
+All of Bork's requests, to package indexes, to GitHub's API, and to Trusted Publishing
+providers, go through the same connection pool: connections are kept alive and reused
+by later requests to the same host, such as when uploading several files.
+
+Requests send a consistent User-Agent, time out rather than hanging, accept gzip-compressed
+responses (which are decompressed transparently), and can stream their body from disk
+(see :py:class:`FileBody` and :py:class:`Multipart`).
+
+Requests which fail transiently are retried, according to a :py:class:`RetryPolicy`:
+after a delay growing exponentially (with jitter), or as long as the server asked for,
+with ``Retry-After`` or GitHub's rate-limit headers.
+Requests which may have had an effect on the server are only retried if repeating them
+is harmless: see :py:func:`request`.
+"""
+
 import urllib3
+from urllib3.fields import RequestField
+from urllib3.filepost import choose_boundary
 
 from . import version
+from .log import logger
+
+from collections.abc import Callable, Iterator, Mapping, Sequence
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+from threading import Lock
+import json, os, random, time
+
+# Connections are kept alive, and reused by later requests to the same host.
+# Up to MAX_CONNECTIONS are kept per host, for requests made concurrently.
+MAX_CONNECTIONS = 8
+
+# Seconds to wait for a connection, and then between bytes received.
+TIMEOUT = urllib3.Timeout(connect = 10, read = 60)
+
+USER_AGENT = f"bork/{version.__version__} (+https://github.com/duckinator/bork)"
+
+_pool = urllib3.PoolManager(maxsize = MAX_CONNECTIONS, timeout = TIMEOUT)
+
+# Failed requests are retried by request() itself, but urllib3 only follows redirects
+# when allowed to retry; so it's only allowed to retry redirects.
+# (It raises MaxRetryError for any other failure, which request() unwraps.)
+_REDIRECTS = urllib3.Retry(total = None, connect = 0, read = 0, status = 0, other = 0, redirect = 5)
+
+
+class HTTPError(RuntimeError):
+    """An error response (4xx or 5xx) from a server"""
+    def __init__(self, message: str, status: int):
+        super().__init__(message)
+        self.status = status
+
+
+@dataclass(frozen = True)
+class RetryPolicy:
+    """When, and how long after, failed requests are retried"""
+    retries: int = 5            # How many times a request is retried; 0 disables retries
+    backoff: float = 1.0        # Maximum delay before the first retry, in seconds; it doubles with each retry
+    max_backoff: float = 60.0   # Maximum delay between retries, unless the server asks for longer
+    max_wait: float = 600.0     # Give up rather than wait longer than this, in total, for a request
+
+    def delay(self, attempt: int, response: urllib3.BaseHTTPResponse | None = None) -> float:
+        """How long to wait before retrying, after the given attempt (starting at 0) failed."""
+        if response is not None and (requested := _requested_delay(response)) is not None:
+            return requested
+        # "Full jitter", so concurrent requests which failed together are retried at different times.
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+
+# Methods which can be repeated without changing their outcome.
+IDEMPOTENT_METHODS = frozenset(("GET", "HEAD", "OPTIONS", "PUT", "DELETE"))
+
+# Errors which might be transient, and after which idempotent requests are retried.
+RETRY_STATUSES = frozenset((408, 429, 500, 502, 503, 504))
+
+# Errors which mean the server didn't process the request, so any request can be retried.
+REJECTED_STATUSES = frozenset((429, 503))
+
+_retry_policy = RetryPolicy()
+_retry_lock = Lock()
+_retry_count, _retry_wait = 0, 0.0
+
+
+def set_retry_policy(policy: RetryPolicy) -> None:
+    """Set the policy used by requests which don't specify one."""
+    global _retry_policy
+    _retry_policy = policy
+
+
+def retry_policy() -> RetryPolicy:
+    """The policy used by requests which don't specify one."""
+    return _retry_policy
+
+
+def retry_stats() -> tuple[int, float]:
+    """How many times requests were retried, and how long was spent waiting to retry them, in seconds."""
+    with _retry_lock:
+        return _retry_count, _retry_wait
+
+
+def _requested_delay(response: urllib3.BaseHTTPResponse) -> float | None:
+    """How long the server asked to wait before retrying, if it did."""
+    if retry_after := response.headers.get("Retry-After"):
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    # GitHub's rate limit: the number of requests left, and when it resets (in seconds since the epoch)
+    reset = response.headers.get("X-RateLimit-Reset")
+    if response.headers.get("X-RateLimit-Remaining") == "0" and reset and reset.isdigit():
+        return max(0.0, int(reset) - time.time()) + 1
+
+    return None
+
+
+def _retryable(response: urllib3.BaseHTTPResponse, idempotent: bool) -> bool:
+    if response.status in REJECTED_STATUSES:
+        return True
+    if response.status == 403:
+        # GitHub responds with 403 (or 429) when rate-limited, with headers saying until when.
+        return _requested_delay(response) is not None
+    return idempotent and response.status in RETRY_STATUSES
+
+
+class FileBody:
+    """A request body streamed from a file, which is only read (in chunks) while being sent
+
+    Unlike an open file, it is sent again from the start if the request is retried.
+    `progress`, if given, is called after each chunk with how many bytes were sent so far.
+    """
+    CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, path: Path, progress: Callable[[int], None] | None = None):
+        self.path = path
+        self.size = path.stat().st_size
+        self.progress = progress
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __iter__(self) -> Iterator[bytes]:
+        remaining = self.size
+        with self.path.open("rb") as f:
+            while chunk := f.read(min(self.CHUNK_SIZE, remaining)):
+                remaining -= len(chunk)
+                yield chunk
+                if self.progress:
+                    self.progress(self.size - remaining)
+
+        # The Content-Length was computed beforehand, and must match what is sent.
+        if remaining:
+            raise RuntimeError(f"'{self.path}' changed while it was being uploaded")
+
+
+class Multipart:
+    """A multipart/form-data request body, which streams files from disk
+
+    Unlike urllib3's ``fields``, which encode the whole body in memory, files are
+    only read (in chunks) while the body is being sent, so uploading large files
+    does not require holding them in memory.
+
+    Each field is a ``(name, value)`` pair, where the value is either a string or
+    a ``(filename, path, content_type)`` tuple for files.
+    """
+    def __init__(self, fields: Sequence[tuple[str, str | tuple[str, Path, str]]]):
+        self.boundary = choose_boundary()
+        # Each part is either data to send as-is, or a file.
+        self.parts: list[bytes | FileBody] = []
+
+        for (name, value) in fields:
+            self.parts.append(f"--{self.boundary}\r\n".encode("latin-1"))
+            if isinstance(value, tuple):
+                filename, path, content_type = value
+                field = RequestField.from_tuples(name, (filename, b"", content_type))
+                self.parts.append(field.render_headers().encode("utf-8"))
+                self.parts.append(FileBody(path))
+            else:
+                field = RequestField.from_tuples(name, value)
+                self.parts.append(field.render_headers().encode("utf-8") + value.encode("utf-8"))
+            self.parts.append(b"\r\n")
+
+        self.parts.append(f"--{self.boundary}--\r\n".encode("latin-1"))
+
+    @property
+    def content_type(self) -> str:
+        return f"multipart/form-data; boundary={self.boundary}"
+
+    def __len__(self) -> int:
+        return sum(map(len, self.parts))
+
+    def __iter__(self) -> Iterator[bytes]:
+        for part in self.parts:
+            if isinstance(part, FileBody):
+                yield from part
+            else:
+                yield part
+
+
+def request(method, url, fields=None, auth=None, body=None, headers: Mapping[str, str] | None = None, *,
+            idempotent: bool | None = None, retry: RetryPolicy | None = None,
+            on_retry: Callable[[], None] | None = None):
+    """Send a request, raising :py:class:`HTTPError` if the server responds with an error.
+
+    `fields` are form fields, encoded in memory by urllib3; `auth` is a (username, password) pair.
+    `body` can instead be a :py:class:`Multipart` or :py:class:`FileBody` (which are streamed),
+    an open binary file (also streamed), bytes, or a dict or list (sent as JSON).
+    Redirects are followed; 307 and 308 redirects keep the method and body.
+
+    Failed requests are retried according to `retry`, by default the policy set with
+    :py:func:`set_retry_policy`. Failures which might happen after the server acted on the
+    request, such as a dropped connection or a 502 error, are only retried if the request is
+    `idempotent`; by default, whether its method is in `IDEMPOTENT_METHODS`.
+    `on_retry`, if given, is called before each retry, such as to undo what a failed
+    request did, so it can be repeated.
+    """
+    log = logger()
+    policy = retry or _retry_policy
+    if idempotent is None:
+        idempotent = method in IDEMPOTENT_METHODS
+
+    all_headers = urllib3.util.make_headers(user_agent=USER_AGENT, accept_encoding="gzip",
+                                            basic_auth=":".join(auth) if auth else None)
+
+    start = None
+    if isinstance(body, Multipart):
+        all_headers["Content-Type"] = body.content_type
+        all_headers["Content-Length"] = str(len(body))
+    elif isinstance(body, FileBody):
+        all_headers["Content-Type"] = "application/octet-stream"
+        all_headers["Content-Length"] = str(len(body))
+    elif isinstance(body, (dict, list)):
+        body = json.dumps(body).encode()
+        all_headers["Content-Type"] = "application/json"
+    elif hasattr(body, "fileno"):
+        start = body.tell()  # To send the same data again, if retrying
+        all_headers["Content-Length"] = str(os.fstat(body.fileno()).st_size - start)
+
+    all_headers.update(headers or {})
+
+    retries, wait = 0, 0.0
+
+    def backoff(reason, delay: float) -> bool:
+        """Wait before retrying, unless the policy says to give up."""
+        global _retry_count, _retry_wait
+        nonlocal retries, wait
+        if retries >= policy.retries or wait + delay > policy.max_wait:
+            if retries:
+                log.warning("%s %s failed (%s) after %d retries, and %.1fs waiting",
+                            method, url, reason, retries, wait)
+            return False
+
+        log.warning("%s %s failed (%s); retrying in %.1fs (retry %d of %d)",
+                    method, url, reason, delay, retries + 1, policy.retries)
+        time.sleep(delay)
+        retries, wait = retries + 1, wait + delay
+        with _retry_lock:
+            _retry_count, _retry_wait = _retry_count + 1, _retry_wait + delay
+        if on_retry:
+            on_retry()
+        return True
+
+    while True:
+        if start is not None:
+            body.seek(start)
 
-MAX_RETRIES = False
+        try:
+            response = _pool.request(method, url, fields=fields, body=body, headers=all_headers,
+                                     retries=_REDIRECTS)
+        except urllib3.exceptions.HTTPError as e:
+            error: Exception = e.reason if isinstance(e, urllib3.exceptions.MaxRetryError) and e.reason else e
+            # Failing to connect means nothing was sent, so retrying is always safe.
+            if (idempotent or isinstance(error, urllib3.exceptions.ConnectTimeoutError)) \
+                    and backoff(error, policy.delay(retries)):
+                continue
+            raise error from None
 
-def request(method, url, fields, auth):
-    user_agent = f"bork/{version.__version__} (+https://github.com/duckinator/bork)"
+        if response.status > 399 and _retryable(response, idempotent) \
+                and backoff(f"HTTP status {response.status}", policy.delay(retries, response)):
+            continue
+        break
 
-    http = urllib3.PoolManager()
-    headers = urllib3.util.make_headers(user_agent=user_agent, basic_auth=":".join(auth))
-    response = http.request(method, url, fields=fields, headers=headers, retries=MAX_RETRIES)
+    if retries and response.status < 400:
+        log.info("%s %s succeeded after %d retries, and %.1fs waiting", method, url, retries, wait)
 
-    if 399 < response.status < 500:
-        raise RuntimeError(response.data.decode())
+    if response.status > 399:
+        raise HTTPError(response.data.decode().strip() or f"{method} {url}: HTTP status {response.status}",
+                        response.status)
 
     return response
 
-def get(url, auth=None):
-    return request("GET", url, None, auth)
+def get(url, auth=None, headers=None):
+    return request("GET", url, None, auth, headers=headers)
 
-def post(url, fields=None, auth=None):
-    return request("POST", url, fields, auth)
+def post(url, fields=None, auth=None, body=None, headers=None):
+    return request("POST", url, fields, auth, body, headers)
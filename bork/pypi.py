@@ -1,17 +1,32 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import cache
 import hashlib
+from html.parser import HTMLParser
 from pathlib import Path
+from urllib.parse import unquote
 
-from . import builder
+from packaging.utils import canonicalize_name
+import urllib3
+
+from . import http
 from .creds import Credentials
-from .filesystem import find_files, wheel_file_info
+from .filesystem import dist_metadata, find_files, wheel_file_info
 from .log import logger
-from .http import post
 
 
 class Uploader:
     PYPI_ENDPOINT = "https://upload.pypi.org/legacy/"
     TESTPYPI_ENDPOINT = "https://test.pypi.org/legacy/"
 
+    # How many files are uploaded concurrently, by default.
+    WORKERS = 4
+
+    # Indexes (serving the simple API) of the repositories above, to find files already uploaded.
+    INDEXES = {
+        PYPI_ENDPOINT: "https://pypi.org/simple/",
+        TESTPYPI_ENDPOINT: "https://test.pypi.org/simple/",
+    }
+
     def __init__(self, files, repository=None):
         log = logger()
 
@@ -37,9 +52,9 @@ class Uploader:
         self.files = files
         self.repository = repository
 
-    def _upload_file(self, url, file, metadata):
-        file_contents = Path(file).read_bytes()
-        file_digest = hashlib.sha256(file_contents).hexdigest()
+    def _upload_file(self, url, file, metadata, auth):
+        # The digest is computed beforehand, so the file can be streamed while uploading it.
+        file_digest = _sha256(file)
 
         if file.endswith(".whl"):
             file_type = "bdist_wheel"
@@ -50,7 +65,13 @@ class Uploader:
 
         # From <https://docs.pypi.org/api/upload/>:
         # "All fields need to be renamed to lowercase and hyphens need to replaced by underscores."
-        md = {k.lower().replace('-', '_'): v for (k, v) in metadata.items()}
+        md = {}
+        for (k, v) in metadata.items():
+            md.setdefault(k.lower().replace('-', '_'), []).append(v)
+
+        # Since metadata version 2.1, the description may be in the message body.
+        if "description" not in md and metadata.json.get("description"):
+            md["description"] = [metadata.json["description"]]
 
         # https://packaging.python.org/en/latest/specifications/core-metadata/
         wanted_fields = [
@@ -86,68 +107,167 @@ class Uploader:
             if key not in wanted_fields:
                 continue
 
-            values = md[key]
-            if not isinstance(values, list):
-                values = [values]
-
-            for value in values:
+            for value in md[key]:
                 other_fields.append((key, value))
 
         form = [
             (":action", "file_upload"),
             ("protocol_version", "1"),
-            ("content", (Path(file).name, file_contents, "application/octet-stream")),
+            ("content", (Path(file).name, Path(file), "application/octet-stream")),
             ("sha256_digest", file_digest),
             ("filetype", file_type),
             ("pyversion", pyversion),
 
             # Required "core metadata" fields.
             # These are set here to trigger a hard error if they're missing.
-            ("metadata_version", md["metadata_version"]),
-            ("name", md["name"]),
-            ("version", md["version"]),
+            ("metadata_version", md["metadata_version"][0]),
+            ("name", md["name"][0]),
+            ("version", md["version"][0]),
 
             # Remaining "core metadata" fields.
             *other_fields
             ]
 
-        username, password = self._get_credentials()
+        response = http.post(url, auth=auth, body=http.Multipart(form))
+        return response
 
-        if username is None and password is None:
-            raise RuntimeError(
-                "BORK_PYPI_USERNAME and BORK_PYPI_PASSWORD environment variables are undefined.\n\n"
-                "If you used Bork prior to v9.0.0, these variables used to be TWINE_USERNAME and "
-                "TWINE_PASSWORD. You can use the same values.")
+    def upload(self, *, dry_run = True, metadata = None, workers = None, skip_existing = False):
+        """Upload the files to the repository, concurrently.
 
-        response = post(url, form, auth=(username, password))
-        return response
+        Unless `metadata` is given, each file's core metadata is read from the file itself.
+        `workers` is how many files are uploaded at once, by default `WORKERS`.
+        If `skip_existing` is true, files already on the repository (with the same SHA-256
+        digest) are not uploaded again; see `existing_files`.
 
-    def upload(self, *, dry_run = True, metadata = None):
+        Returns a dict mapping each file to `None` if it was uploaded (or skipped), or else to
+        an error message; RuntimeError is raised if any file couldn't be uploaded.
+        """
         log = logger()
 
         msg_prefix = "Uploading"
         if dry_run:
             msg_prefix = "Pretending to upload"
 
-        if metadata is None:
-            # Pure sadness, more hardcoded paths and another rebuild  >_>'
-            with builder.prepare(Path.cwd(), Path("dist")) as b:
-                metadata = b.metadata()
-
         log.info("%s %i files to PyPi repository '%s'.", msg_prefix, len(self.files),
                 self.repository)
-        for file in self.files:
-            filename = Path(file).name
+
+        results = {}
+        with ThreadPoolExecutor(workers or self.WORKERS) as pool:
+            # Credentials are resolved once (which may require minting a token), while
+            # looking for files already uploaded, and then used for every upload.
+            credentials = None if dry_run else pool.submit(self._credentials)
+
+            pending = self.files
+            if skip_existing:
+                pending = self._skip_existing(results, metadata)
+
             if dry_run:
-                log.info("SUCCESS - Pretended to upload %s!", file)
-                continue
+                for file in pending:
+                    log.info("SUCCESS - Pretended to upload %s!", file)
+                    results[file] = None
+                pending = []
+
+            # Fails before uploading anything if there are no credentials.
+            auth = credentials.result() if pending and credentials else None
+
+            def upload_one(file):
+                try:
+                    response = self._upload_file(self.repository, file, metadata or dist_metadata(file), auth)
+                except (RuntimeError, OSError, urllib3.exceptions.HTTPError) as e:
+                    return str(e).strip() or type(e).__name__
+
+                if response.status == 200:
+                    return None
+                return response.data.decode().strip() or f"HTTP status {response.status}"
+
+            futures = {pool.submit(upload_one, file): file for file in pending}
+            for future in as_completed(futures):
+                file = futures[future]
+                filename = Path(file).name
+                results[file] = error = future.result()
+                if error is None:
+                    log.info("SUCCESS - %s uploaded to %s", filename, self.repository)
+                else:
+                    log.error("FAILED  - %s couldn't be uploaded to %s", filename, self.repository)
+                    log.error(error)
+
+        failed = [Path(file).name for (file, error) in results.items() if error is not None]
+        if failed:
+            raise RuntimeError(f"Failed to upload {len(failed)} of {len(self.files)} files "
+                               f"to {self.repository}: {', '.join(sorted(failed))}")
+
+        return {file: results[file] for file in self.files}
+
+    def _skip_existing(self, results, metadata):
+        """Record files already on the repository in `results`, returning those which aren't."""
+        log = logger()
+        existing = {}
+        for project in {(metadata or dist_metadata(file))["Name"] for file in self.files}:
+            existing.update(self.existing_files(project))
 
-            response = self._upload_file(self.repository, file, metadata)
-            if response.status == 200:
-                log.info("SUCCESS - %s uploaded to %s", filename, self.repository)
+        pending = []
+        for file in self.files:
+            filename = Path(file).name
+            if filename not in existing:
+                pending.append(file)
+            elif existing[filename] is None:
+                log.warning("SKIPPED - %s is already on %s, but its digest is unknown",
+                            filename, self.repository)
+                results[file] = None
+            elif existing[filename] == _sha256(file):
+                log.info("SKIPPED - %s is already on %s", filename, self.repository)
+                results[file] = None
             else:
-                log.info("FAILED  - %s couldn't be uploaded to %s", filename, self.repository)
-                log.info(response.data.decode().strip())
+                log.error("FAILED  - %s couldn't be uploaded to %s", filename, self.repository)
+                results[file] = f"A different file named {filename} is already on {self.repository}"
+                log.error(results[file])
+
+        return pending
+
+    def existing_files(self, project):
+        """List the files of a project which are already on the repository.
+
+        Returns a dict mapping filenames to their SHA-256 digest, fetched from the
+        repository's index using the simple API: as JSON (PEP 691) if the index supports
+        it, or else as HTML (PEP 503).
+        """
+        index = self.INDEXES.get(self.repository)
+        if index is None:
+            logger().warning("Don't know the index of '%s', so can't skip files already uploaded.",
+                             self.repository)
+            return {}
+
+        url = f"{index}{canonicalize_name(project)}/"
+        logger().debug("Listing files already on the index: %s", url)
+        try:
+            response = http.get(url, headers={
+                "Accept": "application/vnd.pypi.simple.v1+json, text/html;q=0.1",
+            })
+        except http.HTTPError as e:
+            if e.status == 404:  # The project doesn't exist yet.
+                return {}
+            raise
+
+        if "json" in response.headers.get("Content-Type", ""):
+            return {
+                f["filename"]: f["hashes"].get("sha256")
+                for f in response.json()["files"]
+            }
+
+        links = _SimpleIndexLinks()
+        links.feed(response.data.decode())
+        return links.files
+
+    def _credentials(self):
+        username, password = self._get_credentials()
+
+        if username is None and password is None:
+            raise RuntimeError(
+                "BORK_PYPI_USERNAME and BORK_PYPI_PASSWORD environment variables are undefined.\n\n"
+                "If you used Bork prior to v9.0.0, these variables used to be TWINE_USERNAME and "
+                "TWINE_PASSWORD. You can use the same values.")
+
+        return (username, password)
 
     def _get_credentials(self):
         username = None
@@ -161,6 +281,35 @@ class Uploader:
         return (username, password)
 
 
+class _SimpleIndexLinks(HTMLParser):
+    """Collects the files listed by an HTML simple API (PEP 503) page."""
+    def __init__(self):
+        super().__init__()
+        self.files = {}
+
+    def handle_starttag(self, tag, attrs):
+        href = dict(attrs).get("href")
+        if tag != "a" or not href:
+            return
+
+        url, _, fragment = href.partition("#")
+        algorithm, _, digest = fragment.partition("=")
+        filename = unquote(url.rsplit("/", 1)[-1])
+        self.files[filename] = digest if algorithm == "sha256" else None
+
+
+def _sha256(file):
+    # Files are hashed at most once, unless they change.
+    stat = Path(file).stat()
+    return _cached_sha256(str(file), stat.st_mtime_ns, stat.st_size)
+
+
+@cache
+def _cached_sha256(file, _mtime, _size):
+    with Path(file).open("rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+
 def upload(repository_name, *globs, **kwargs):
     files = find_files(globs)
-    Uploader(files, repository_name).upload(**kwargs)
+    return Uploader(files, repository_name).upload(**kwargs)
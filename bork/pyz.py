@@ -0,0 +1,633 @@
+"""Assembling zipapps from built wheels
+
+A zipapp contains the package's own wheel, and the wheels of its runtime dependencies.
+The set of dependencies is resolved once, and pinned in a lock file; the wheels
+obtained from a given lock file are kept in Bork's cache (see :py:mod:`bork.cache`).
+
+Zipapps are assembled directly from those wheels, without installing them:
+their members are copied into the archive, without being recompressed
+(see :py:mod:`bork.archive`), except that wheels' ``.data`` directories
+are mapped the way an installer would, for the parts which are importable.
+
+As :py:mod:`zipimport` cannot write bytecode caches, modules can be precompiled
+when the zipapp is built; bytecode is stored next to each module's source,
+where :py:mod:`zipimport` looks for it, and is hash-based to keep builds reproducible.
+
+Neither can :py:mod:`zipimport` load native extensions, so zipapps which contain some
+get a bootstrap ``__main__.py``, which extracts the top-level packages containing
+native code to a cache directory on first run, and imports them from there.
+
+To keep zipapps small, files can be left out using glob patterns, built-in
+:py:data:`STRIP_PROFILES`, and an analysis of which top-level packages are
+(statically) imported from the entry point; see :py:func:`select`.
+
+Rebuilding a zipapp is incremental: an index records how each member which Bork
+compressed or compiled was generated, so that unchanged members are copied from
+the previous archive, rather than generated again. Likewise, several zipapps can
+be assembled from the same wheels at once, generating their common members once.
+"""
+
+from . import archive, cache
+from .env import normalize
+from .filesystem import dist_metadata
+from .log import logger
+
+from packaging.utils import canonicalize_name
+
+from collections.abc import Callable, Collection, Iterator, Mapping, Sequence
+from contextlib import ExitStack, contextmanager
+from dataclasses import dataclass
+from fnmatch import fnmatchcase
+from functools import partial
+from pathlib import Path, PurePosixPath
+from tempfile import TemporaryDirectory
+from typing import BinaryIO
+import ast, functools, hashlib, heapq, importlib.util, json, marshal, os, subprocess, sys, sysconfig, zipfile
+
+
+# Bump whenever the format of lock files, or the layout of cached dependencies, changes.
+LOCK_FORMAT = 2
+
+# Eviction policy for cached dependencies
+MAX_TREES = 16
+MAX_BYTES = 2 * 1024 ** 3
+
+# Bump whenever the format of zipapp indexes, or how members are generated, changes.
+INDEX_FORMAT = 2
+
+# Same as the __main__.py generated by the zipapp module
+MAIN_TEMPLATE = """\
+import {module}
+{module}.{function}()
+"""
+
+# Where a package's own __main__.py is moved, when the zipapp needs a bootstrap
+PACKAGE_MAIN = "__bork_main__"
+
+NATIVE_SUFFIXES = (".so", ".pyd", ".dylib", ".dll")
+
+# Preamble of the __main__.py of zipapps containing native code, which cannot be imported from the archive.
+# Extracted files are keyed by their digest, and are extracted to a temporary directory first,
+# so that concurrent runs of the same zipapp never see a partially extracted directory.
+BOOTSTRAP_TEMPLATE = """\
+import os, sys
+
+def _bork_extract(key, prefixes):
+    if cache := os.environ.get("BORK_CACHE_DIR"):
+        pass
+    elif sys.platform == "win32":
+        cache = os.path.join(os.environ.get("LOCALAPPDATA") or os.path.expanduser("~/AppData/Local"), "bork")
+    elif sys.platform == "darwin":
+        cache = os.path.expanduser("~/Library/Caches/bork")
+    else:
+        cache = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "bork")
+
+    target = os.path.join(cache, "zipapps", key)
+    if not os.path.isdir(target):
+        import shutil, zipfile
+        tmp = f"{{target}}.{{os.getpid()}}.tmp"
+        with zipfile.ZipFile(os.path.dirname(__file__)) as zf:
+            for info in zf.infolist():
+                if info.filename.startswith(prefixes):
+                    path = zf.extract(info, tmp)
+                    if mode := (info.external_attr >> 16) & 0o777:
+                        os.chmod(path, mode)
+        try:
+            os.rename(tmp, target)
+        except OSError:  # Extracted concurrently by another process
+            shutil.rmtree(tmp, ignore_errors = True)
+
+    sys.path.insert(0, target)
+
+_bork_extract({key!r}, {prefixes!r})
+del _bork_extract
+
+"""
+
+
+def _target() -> dict[str, str]:
+    """The environment dependencies are resolved and installed for."""
+    return {
+        "python": ".".join(map(str, sys.version_info[:2])),
+        "platform": sysconfig.get_platform(),
+    }
+
+
+def _pip(*args) -> None:
+    subprocess.check_call((sys.executable, '-m', 'pip', *args))
+
+
+def _pin(item: dict) -> str:
+    """Turn an entry of pip's installation report into a requirement."""
+    name = canonicalize_name(item["metadata"]["name"])
+    info = item["download_info"]
+
+    if item.get("is_direct"):
+        return f"{name} @ {info['url']}"
+
+    pin = f"{name}=={item['metadata']['version']}"
+    if sha256 := info.get("archive_info", {}).get("hashes", {}).get("sha256"):
+        pin += f" --hash=sha256:{sha256}"
+    return pin
+
+
+def lock_dependencies(wheel: Path, lock_file: Path) -> list[str]:
+    """Pin the runtime dependencies of a wheel, resolving them only if needed.
+
+    The lock file records the wheel's requirements and the target environment
+    it was resolved for; dependencies are only resolved again if those changed.
+
+    :returns: The pinned requirements.
+    """
+    log = logger()
+    meta = dist_metadata(wheel)
+
+    inputs = json.dumps({
+        "format": LOCK_FORMAT,
+        "requires": normalize(meta.get_all("Requires-Dist") or []),
+        "target": _target(),
+    }, sort_keys = True)
+    header = f"# input: {hashlib.sha256(inputs.encode()).hexdigest()}"
+
+    try:
+        lines = lock_file.read_text(encoding = "utf-8").splitlines()
+        if header in lines:
+            log.debug(f"Using dependencies pinned in '{lock_file}'")
+            return [line for line in lines if line and not line.startswith("#")]
+    except FileNotFoundError:
+        pass
+
+    log.info(f"Resolving the runtime dependencies of '{wheel.name}'")
+    pins: list[str] = []
+    if meta.get_all("Requires-Dist"):
+        with TemporaryDirectory() as tmp:
+            report = Path(tmp) / "report.json"
+            _pip('install', '--dry-run', '--ignore-installed', '--quiet', '--report', report, wheel)
+            items = json.loads(report.read_text(encoding = "utf-8"))["install"]
+
+        pins = sorted(
+            _pin(item) for item in items
+            if canonicalize_name(item["metadata"]["name"]) != canonicalize_name(meta["Name"])
+        )
+
+        # pip requires hashes for either all requirements or none
+        if not all("--hash=" in pin for pin in pins):
+            pins = [pin.split(" --hash=")[0] for pin in pins]
+
+    lock_file.parent.mkdir(parents = True, exist_ok = True)
+    lock_file.write_text("\n".join((
+        f"# Runtime dependencies of {meta['Name']} {meta['Version']}, pinned by Bork.",
+        header,
+        *pins,
+    )) + "\n", encoding = "utf-8")
+
+    return pins
+
+
+@contextmanager
+def dependencies(pins: list[str]) -> Iterator[list[Path]]:
+    """Context manager providing the wheels of pinned dependencies.
+
+    Dependencies only available as sdists are built into wheels once, when they are cached.
+    """
+    if not pins:
+        yield []
+        return
+
+    key = json.dumps({"format": LOCK_FORMAT, "pins": pins, "target": _target()}, sort_keys = True)
+
+    def populate(path: Path) -> None:
+        logger().info("Fetching runtime dependencies: %s", ", ".join(p.split(" ")[0] for p in pins))
+        with TemporaryDirectory() as tmp:
+            requirements = Path(tmp) / "requirements.txt"
+            requirements.write_text("\n".join(pins) + "\n", encoding = "utf-8")
+            _pip('wheel', '--quiet', '--no-deps', '--wheel-dir', path, '-r', requirements)
+
+    with cache.entry(cache.cache_dir("zipapp-deps"), hashlib.sha256(key.encode()).hexdigest()[:32],
+                     populate, max_entries = MAX_TREES, max_bytes = MAX_BYTES) as (path, _):
+        yield sorted(path.glob("*.whl"))
+
+
+def _members(wheel: zipfile.ZipFile) -> Iterator[tuple[str, zipfile.ZipInfo]]:
+    """The members of a wheel which belong in a zipapp, and their path there."""
+    for info in wheel.infolist():
+        if info.is_dir():
+            continue
+
+        top, _, rest = info.filename.partition("/")
+        if not top.endswith(".data"):
+            yield info.filename, info
+            continue
+
+        # Scripts, headers and data files cannot be used from a zipapp.
+        scheme, _, rest = rest.partition("/")
+        if scheme in ("purelib", "platlib") and rest:
+            yield rest, info
+
+
+def _entry_point(main: str) -> str:
+    module, _, function = main.partition(":")
+    if not all(part.isidentifier() for part in (*module.split("."), *function.split("."))):
+        raise RuntimeError(f"Invalid zipapp entry point '{main}', expected 'pkg.mod:func'")
+
+    return MAIN_TEMPLATE.format(module = module, function = function)
+
+
+def _is_native(name: str) -> bool:
+    return name.endswith(NATIVE_SUFFIXES) or ".so." in name.rsplit("/", 1)[-1]
+
+
+def _native_prefixes(members: Mapping[str, zipfile.ZipInfo]) -> tuple[str, ...]:
+    """The top-level packages and modules which need extracting, as prefixes of member names."""
+    return tuple(sorted({
+        name.split("/")[0] + ("/" if "/" in name else "")
+        for name in members if _is_native(name)
+    }))
+
+
+def _bootstrap(members: Mapping[str, zipfile.ZipInfo], prefixes: tuple[str, ...]) -> str:
+    digest = hashlib.sha256()
+    for name, info in sorted(members.items()):
+        if name.startswith(prefixes):
+            digest.update(f"{name}\0{info.CRC}\0{info.file_size}\0".encode())
+
+    return BOOTSTRAP_TEMPLATE.format(key = digest.hexdigest()[:32], prefixes = prefixes)
+
+
+def _in_dirs(path: PurePosixPath, *names: str) -> bool:
+    return not set(names).isdisjoint(path.parts[:-1])
+
+
+# Kinds of files which are not needed to run most zipapps; metadata directories are always kept.
+STRIP_PROFILES: dict[str, Callable[[PurePosixPath], bool]] = {
+    "tests": lambda p: _in_dirs(p, "tests", "test") or p.name == "conftest.py",
+    "stubs": lambda p: p.suffix == ".pyi" or p.name == "py.typed" or p.parts[0].endswith("-stubs"),
+    "docs": lambda p: _in_dirs(p, "docs", "doc") or p.suffix in (".md", ".rst"),
+}
+
+
+def _top_level(name: str) -> str:
+    """The name of the top-level package or module a member belongs to."""
+    top, slash, _ = name.partition("/")
+    return top if slash else top.split(".")[0]
+
+
+def _imports(source: bytes) -> Iterator[str]:
+    """The top-level names a module imports, including with constant-string dynamic imports."""
+    try:
+        tree = ast.parse(source)
+    except (SyntaxError, ValueError):
+        return
+
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            yield from (alias.name.split(".")[0] for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+            yield node.module.split(".")[0]
+        elif isinstance(node, ast.Call) and node.args and isinstance(node.args[0], ast.Constant) \
+             and isinstance(node.args[0].value, str) \
+             and getattr(node.func, "id", getattr(node.func, "attr", None)) in ("__import__", "import_module"):
+            yield node.args[0].value.split(".")[0]
+
+
+def _reachable(roots: Collection[str], members: Collection[str], read: Callable[[str], bytes]) -> set[str]:
+    """The top-level packages and modules imported, directly or not, by the given roots."""
+    packages: dict[str, list[str]] = {}
+    for name in members:
+        packages.setdefault(_top_level(name), []).append(name)
+
+    seen: set[str] = set()
+    todo = [r for r in roots if r in packages]
+    while todo:
+        top = todo.pop()
+        if top in seen:
+            continue
+
+        seen.add(top)
+        for name in packages[top]:
+            if name.endswith(".py"):
+                todo.extend(m for m in _imports(read(name)) if m in packages and m not in seen)
+
+    return seen
+
+
+def _human(size: int) -> str:
+    value = float(size)
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if value < 1024 or unit == "GiB":
+            break
+        value /= 1024
+    return f"{size} B" if unit == "B" else f"{value:.1f} {unit}"
+
+
+def select(members: Mapping[str, zipfile.ZipInfo], read: Callable[[str], bytes], *,
+           main: str | None, include: Collection[str] = (), exclude: Collection[str] = (),
+           strip: Collection[str] = (), shake: bool = False) -> set[str]:
+    """Choose which members go into a zipapp, and log how much was left out.
+
+    :param read: Returns the contents of a member, given its name.
+    :param main: The zipapp's entry point, where reachability analysis starts from.
+    :param include: Glob patterns of members to keep regardless of other rules.
+    :param exclude: Glob patterns of members to leave out.
+    :param strip: Names of :py:data:`STRIP_PROFILES` whose members to leave out.
+    :param shake: Whether to leave out top-level packages and modules which the entry point
+                  never imports, directly or not. Only imports visible in the source are found,
+                  so packages which are imported dynamically may need to be ``include``-d.
+    :returns: The names of members to keep.
+    """
+    def kept(name: str) -> bool:
+        return any(fnmatchcase(name, pattern) for pattern in include)
+
+    removed: dict[str, set[str]] = {}
+    for name in members:
+        path = PurePosixPath(name)
+        if kept(name):
+            continue
+        elif any(fnmatchcase(name, pattern) for pattern in exclude):
+            removed.setdefault("excluded", set()).add(name)
+        elif not path.parts[0].endswith(".dist-info"):
+            for profile in strip:
+                if STRIP_PROFILES[profile](path):
+                    removed.setdefault(profile, set()).add(name)
+                    break
+
+    remaining = set(members).difference(*removed.values())
+    if shake:
+        roots = {main.split(":")[0].split(".")[0] if main else "__main__"}
+        reachable = _reachable(roots, remaining, read)
+        unreachable = {
+            name for name in remaining
+            if _top_level(name).isidentifier() and _top_level(name) not in reachable and not kept(name)
+        }
+        if unreachable:
+            removed["unreachable"] = unreachable
+            remaining -= unreachable
+
+    log = logger()
+    for reason, names in removed.items():
+        if not names:
+            continue
+
+        size = sum(members[n].file_size for n in names)
+        detail = f": {', '.join(sorted({_top_level(n) for n in names}))}" if reason == "unreachable" else ""
+        log.info(f"Left out {len(names)} files ({_human(size)}): {reason}{detail}")
+
+    if removed:
+        total = sum(members[n].file_size for n in set(members) - remaining)
+        log.info(f"Left out {_human(total)} of {_human(sum(i.file_size for i in members.values()))} in total")
+
+    return remaining
+
+
+def _bytecode(name: str, source: bytes, *, optimize: int, checked: bool) -> bytes | None:
+    """Compile a module into a hash-based pyc, for the running Python version.
+
+    :returns: ``None`` if the module cannot be compiled.
+    """
+    try:
+        code = compile(source, name, "exec", dont_inherit = True, optimize = optimize)
+    except (SyntaxError, ValueError):
+        return None
+
+    return b"".join((
+        importlib.util.MAGIC_NUMBER,
+        (0b11 if checked else 0b01).to_bytes(4, "little"),  # hash-based, and whether to check it
+        importlib.util.source_hash(source),
+        marshal.dumps(code),
+    ))
+
+
+def _sha256(path: Path) -> str:
+    with path.open("rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+
+@dataclass(frozen = True)
+class Target:
+    """A zipapp to assemble"""
+    path: Path
+    main: str | None            # Entry point, or None if a wheel provides a top-level __main__.py
+    interpreter: str | None     # Interpreter in the shebang line, if any
+
+
+@dataclass(frozen = True)
+class _Source:
+    """An archive members can be copied from, and how they were generated"""
+    file: BinaryIO
+    members: dict[str, zipfile.ZipInfo]
+    keys: Mapping[str, str]
+
+    @classmethod
+    def open(cls, path: Path, keys: Mapping[str, str], stack: ExitStack) -> '_Source':
+        f = stack.enter_context(path.open("rb"))
+        return cls(f, {i.filename: i for i in stack.enter_context(zipfile.ZipFile(f)).infolist()}, keys)
+
+
+def _load_index(index: Path, stack: ExitStack) -> list[_Source]:
+    """The archives described by an index, which are still intact."""
+    try:
+        data = json.loads(index.read_text(encoding = "utf-8"))
+        if data["format"] != INDEX_FORMAT:
+            return []
+
+        sources = []
+        for name, entry in data["archives"].items():
+            path = index.parent / name
+            if path.is_file() and _sha256(path) == entry["sha256"]:
+                logger().debug(f"Reusing unchanged members of '{path}'")
+                sources.append(_Source.open(path, entry["members"], stack))
+        return sources
+
+    except (FileNotFoundError, ValueError, KeyError, TypeError, AttributeError):
+        return []
+
+
+def assemble(target: Path, wheels: Sequence[Path], *, main: str | None, interpreter: str | None,
+             **options) -> None:
+    """Create a zipapp from wheels.
+
+    :param main: The zipapp's entry point, as ``"pkg.mod:func"``, or ``None``
+                 if one of the wheels provides a top-level ``__main__.py``.
+    :param interpreter: The interpreter in the zipapp's shebang line, if any.
+
+    Other keyword arguments are the same as for :py:func:`assemble_many`.
+    """
+    assemble_many([Target(target, main, interpreter)], wheels, **options)
+
+
+def assemble_many(targets: Sequence[Target], wheels: Sequence[Path], *,
+                  optimize: int | None = None, checked_hash: bool = True,
+                  include: Collection[str] = (), exclude: Collection[str] = (),
+                  strip: Collection[str] = (), shake: bool = False,
+                  compresslevel: int = 6, store: Collection[str] = (), workers: int | None = None,
+                  index: Path | None = None) -> None:
+    """Create zipapps from the same wheels, in one pass.
+
+    If several wheels provide the same file, the last one takes precedence,
+    so the package's own wheel should be last.
+    Members which are identical in several zipapps are only compressed and compiled once.
+
+    :param optimize: If set, modules are also precompiled at that optimization level.
+    :param checked_hash: Whether imports check precompiled modules against their source.
+    :param compresslevel: The compression level of members which are not already compressed in wheels,
+                          and of generated members.
+    :param store: File extensions of members which are stored uncompressed, if not already compressed.
+    :param workers: How many threads compress members; see :py:func:`bork.archive.concurrently`.
+    :param index: Where to record how members were generated. If it describes previously-built
+                  zipapps (at any path in the same directory), members which would be generated
+                  identically are copied from them instead.
+
+    Other keyword arguments select which files are left out; see :py:func:`select`.
+    """
+    log = logger()
+    if len({t.path.name for t in targets}) < len(targets):
+        raise RuntimeError("Zipapps must have distinct file names")
+
+    suffixes = tuple(suffix.lower() for suffix in store)
+
+    def level(name: str) -> int:
+        return 0 if name.lower().endswith(suffixes) else compresslevel
+
+    def recompressed(entry: archive.Entry) -> archive.Entry:
+        return archive.Entry.from_bytes(entry.name, entry.contents(), date_time = entry.date_time,
+                                        mode = entry.mode, compresslevel = level(entry.name))
+
+    def compiled(entry: archive.Entry) -> archive.Entry | None:
+        name = entry.name[:-3] + ".pyc"
+        bytecode = _bytecode(entry.name, entry.contents(), optimize = optimize or 0, checked = checked_hash)
+        if bytecode is None:
+            log.debug(f"Could not compile '{entry.name}', only including its source")
+            return None
+
+        return archive.Entry.from_bytes(name, bytecode, date_time = entry.date_time,
+                                        mode = entry.mode, compresslevel = level(name))
+
+    magic = importlib.util.MAGIC_NUMBER.hex()
+    tmps = {t.path: t.path.with_name(f".{t.path.name}.tmp") for t in targets}
+    keys: dict[Path, dict[str, str]] = {}
+
+    try:
+        with ExitStack() as stack:
+            files = {w: stack.enter_context(w.open("rb")) for w in wheels}
+            archives = {w: stack.enter_context(zipfile.ZipFile(f)) for w, f in files.items()}
+
+            wheel_members: dict[str, tuple[Path, zipfile.ZipInfo]] = {}
+            for wheel, zf in archives.items():
+                for name, info in _members(zf):
+                    if name in wheel_members:
+                        log.debug(f"'{name}' from '{wheel.name}' replaces '{wheel_members[name][0].name}'")
+                    wheel_members[name] = (wheel, info)
+
+            @functools.cache  # Members are read once, even when selecting them for several targets
+            def read(name: str) -> bytes:
+                wheel, info = wheel_members[name]
+                return archives[wheel].read(info)
+
+            sources = _load_index(index, stack) if index else []
+
+            def generate(name: str, key: str, produce: Callable[[], archive.Entry | None],
+                         target_keys: dict[str, str], reused: set[str]) \
+                    -> archive.Entry | Callable[[], archive.Entry | None]:
+                """Generate a member, unless an archive has one which was generated the same way."""
+                target_keys[name] = key
+                for s in sources:
+                    if s.keys.get(name) == key and name in s.members:
+                        reused.add(name)
+                        return archive.Entry.from_zip(s.file, s.members[name])
+                return produce
+
+            # Members are read here, sorted by name; compressing and compiling them happens in worker threads.
+            # Generated members are recorded in `target_keys`, and those copied from other archives in `reused`.
+            def entries(members: dict[str, tuple[Path, zipfile.ZipInfo]], source: str | None,
+                        target_keys: dict[str, str], reused: set[str]) \
+                    -> Iterator[archive.Entry | Callable[[], archive.Entry | None]]:
+                main_entry = archive.Entry.from_bytes("__main__.py", source.encode("utf-8"), compresslevel = 0) \
+                    if source else None
+                copied: Iterator[archive.Entry] = (
+                    archive.Entry.from_zip(files[wheel], info, name = name)
+                    for name, (wheel, info) in sorted(members.items())
+                )
+                if main_entry:
+                    copied = heapq.merge((main_entry, ), copied, key = lambda e: e.name)
+
+                for entry in copied:
+                    origin = f"{entry.crc:08x} {entry.size}"
+                    if entry.method == zipfile.ZIP_STORED and level(entry.name):
+                        yield generate(entry.name, f"deflate {level(entry.name)} {origin}", partial(recompressed, entry),
+                                       target_keys, reused)
+                    else:
+                        yield entry
+
+                    pyc = entry.name[:-3] + ".pyc"
+                    if optimize is not None and entry.name.endswith(".py") and pyc not in members \
+                       and not entry.name.split("/")[0].endswith(".dist-info"):
+                        key = f"pyc {optimize} {checked_hash} {magic} {level(pyc)} {origin}"
+                        yield generate(pyc, key, partial(compiled, entry), target_keys, reused)
+
+            for target in targets:
+                if len(targets) > 1:
+                    log.info(f"Assembling '{target.path.name}'")
+
+                members = dict(wheel_members)
+                if include or exclude or strip or shake:
+                    selected = select(
+                        {name: info for name, (_, info) in members.items()}, read, main = target.main,
+                        include = include, exclude = exclude, strip = strip, shake = shake,
+                    )
+                    members = {name: member for name, member in members.items() if name in selected}
+
+                filename = target.path.name
+                if target.main and "__main__.py" in members:
+                    raise RuntimeError(
+                        f"Cannot specify an entry point for '{filename}', as the package provides '__main__.py'"
+                    )
+                if not target.main and "__main__.py" not in members:
+                    raise RuntimeError(
+                        f"'{filename}' has no entry point: set 'main', or provide a top-level '__main__.py'"
+                    )
+
+                source = _entry_point(target.main) if target.main else None
+                infos = {name: info for name, (_, info) in members.items()}
+                if prefixes := _native_prefixes(infos):
+                    log.info("Native code will be extracted when the zipapp is first run: %s", ", ".join(prefixes))
+                    if not source:
+                        members[f"{PACKAGE_MAIN}.py"] = members.pop("__main__.py")
+                        source = f"import runpy\nrunpy.run_module({PACKAGE_MAIN!r}, run_name = '__main__')\n"
+
+                    source = _bootstrap(infos, prefixes) + source
+
+                target_keys: dict[str, str] = {}
+                reused: set[str] = set()
+
+                tmp = tmps[target.path]
+                prefix = b"#!" + target.interpreter.encode(sys.getfilesystemencoding()) + b"\n" \
+                    if target.interpreter else b""
+                archive.write(tmp, archive.normalized(archive.concurrently(
+                    entries(members, source, target_keys, reused), workers = workers,
+                )), prefix = prefix)
+                if target.interpreter:
+                    tmp.chmod(tmp.stat().st_mode | 0o111)
+
+                if reused:
+                    log.info(f"Reused {len(reused)} of {len(target_keys)} generated members")
+
+                # Later targets can copy members from this one
+                keys[target.path] = target_keys
+                sources.insert(0, _Source.open(tmp, target_keys, stack))
+
+        # Previous archives are closed by now, which Windows requires to replace them.
+        for path, tmp in tmps.items():
+            os.replace(tmp, path)
+
+    finally:
+        for tmp in tmps.values():
+            tmp.unlink(missing_ok = True)
+
+    if index:
+        index.write_text(json.dumps({
+            "format": INDEX_FORMAT,
+            "archives": {
+                path.name: {"sha256": _sha256(path), "members": members}
+                for path, members in keys.items()
+            },
+        }, indent = 2, sort_keys = True), encoding = "utf-8")
@@ -0,0 +1,137 @@
+"""Measuring how fast zipapps start
+
+:py:func:`profile` runs a zipapp repeatedly, each time in a fresh interpreter,
+timing each run and collecting the import times reported by ``python -X importtime``.
+:py:func:`report` and :py:func:`compare` format the results, to find which modules
+are slow to import, or how startup time changed between two builds of a zipapp.
+"""
+
+from .log import logger
+
+from collections.abc import Sequence
+from dataclasses import dataclass, field
+from pathlib import Path
+from statistics import median
+import re, subprocess, sys, time
+
+
+_IMPORT_TIME = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|\s*(\S+)\s*$")
+
+
+@dataclass(frozen = True)
+class Profile:
+    """Startup measurements of a zipapp, over several runs"""
+    archive: Path
+    wall: list[float] = field(default_factory = list)                    # Seconds, per run
+    cumulative: dict[str, list[int]] = field(default_factory = dict)     # Microseconds, per module and run
+    own: dict[str, list[int]] = field(default_factory = dict)            # Same, excluding the module's imports
+
+    @property
+    def median_wall(self) -> float:
+        return median(self.wall)
+
+    def median_cumulative(self, module: str) -> float:
+        """Median time spent importing a module and its dependencies, in microseconds."""
+        return median(self.cumulative[module]) if module in self.cumulative else 0
+
+    def median_own(self, module: str) -> float:
+        """Median time spent importing a module itself, in microseconds."""
+        return median(self.own[module]) if module in self.own else 0
+
+
+def _run(profile: Profile, command: Sequence[str]) -> None:
+    start = time.perf_counter()
+    result = subprocess.run(command, stdin = subprocess.DEVNULL, stdout = subprocess.DEVNULL,
+                            stderr = subprocess.PIPE, text = True, check = False)
+    profile.wall.append(time.perf_counter() - start)
+
+    cumulative: dict[str, int] = {}
+    own: dict[str, int] = {}
+    errors = []
+    for line in result.stderr.splitlines():
+        if match := _IMPORT_TIME.match(line):
+            module = match[3]
+            own[module] = own.get(module, 0) + int(match[1])
+            cumulative[module] = cumulative.get(module, 0) + int(match[2])
+        elif not line.startswith("import time:"):
+            errors.append(line)
+
+    if result.returncode != 0:
+        raise RuntimeError(f"'{profile.archive}' exited with status {result.returncode}:\n" + "\n".join(errors[-10:]))
+
+    for module, us in cumulative.items():
+        profile.cumulative.setdefault(module, []).append(us)
+        profile.own.setdefault(module, []).append(own[module])
+
+
+def profile(archive: Path, *, runs: int = 10, args: Sequence[str] = ("--help", ),
+            python: str = sys.executable, warmup: int = 1) -> Profile:
+    """Run a zipapp several times, and measure how long it takes.
+
+    :param args: Arguments passed to the zipapp, which should make it exit quickly.
+    :param python: The interpreter running the zipapp.
+    :param warmup: How many runs to perform, and discard, before measuring; the first
+                   run can be slower, such as when native code needs to be extracted.
+    """
+    if runs < 1:
+        raise ValueError("At least one run is needed to profile a zipapp")
+
+    command = (python, "-X", "importtime", str(archive), *args)
+    logger().info(f"Running '{archive}' {runs} times")
+
+    for _ in range(warmup):
+        _run(Profile(archive), command)
+
+    result = Profile(archive)
+    for _ in range(runs):
+        _run(result, command)
+
+    return result
+
+
+def _ms(us: float) -> str:
+    return f"{us / 1000:8.1f} ms"
+
+
+def _delta(us: float) -> str:
+    return f"{us / 1000:+8.1f} ms"
+
+
+def report(profile: Profile, *, top: int = 20) -> str:
+    """Summarize a profile, listing the modules slowest to import (including their own imports)."""
+    modules = sorted(profile.cumulative, key = profile.median_cumulative, reverse = True)[:top]
+    return "\n".join((
+        (f"{profile.archive}: median start time {_ms(profile.median_wall * 1e6).strip()} over {len(profile.wall)} runs"
+         f" (min {_ms(min(profile.wall) * 1e6).strip()}, max {_ms(max(profile.wall) * 1e6).strip()})"),
+        f"{'cumulative':>11} {'self':>11}  module",
+        *(
+            f"{_ms(profile.median_cumulative(m))} {_ms(profile.median_own(m))}  {m}"
+            for m in modules
+        ),
+    ))
+
+
+def regression(profile: Profile, baseline: Profile) -> float:
+    """How much slower a zipapp starts than a baseline, relative to it (negative if faster)."""
+    return profile.median_wall / baseline.median_wall - 1
+
+
+def compare(profile: Profile, baseline: Profile, *, top: int = 20) -> str:
+    """Compare two profiles, listing the modules whose import time changed the most."""
+    modules = sorted(
+        profile.cumulative.keys() | baseline.cumulative.keys(),
+        key = lambda m: abs(profile.median_cumulative(m) - baseline.median_cumulative(m)),
+        reverse = True,
+    )[:top]
+    wall, base = profile.median_wall * 1e6, baseline.median_wall * 1e6
+
+    return "\n".join((
+        (f"{profile.archive}: median start time {_ms(wall).strip()}, vs. {_ms(base).strip()} for {baseline.archive}"
+         f" ({_delta(wall - base).strip()}, {regression(profile, baseline):+.1%})"),
+        f"{'change':>11} {'cumulative':>11} {'baseline':>11}  module",
+        *(
+            f"{_delta(profile.median_cumulative(m) - baseline.median_cumulative(m))}"
+            f" {_ms(profile.median_cumulative(m))} {_ms(baseline.median_cumulative(m))}  {m}"
+            for m in modules
+        ),
+    ))
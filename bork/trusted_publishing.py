@@ -1,37 +1,11 @@
-from . import version
+from . import http
 from .log import logger
-import json
-import os
-import urllib.request
+from functools import cache
+from threading import Lock
+import os, time
 from urllib.parse import urlsplit
 
 
-# FIXME: Dedupe request/get/post with bork/github_api.py.
-
-def request(method, url, data, headers):
-    if headers is None:
-        headers = {}
-
-    if isinstance(data, (dict, list)):
-        data = json.dumps(data).encode()
-
-    headers['User-Agent'] = f"bork/{version.__version__} (+https://github.com/duckinator/bork)"
-
-    req = urllib.request.Request(url, data=data,
-                                 headers=headers, method=method)
-
-    with urllib.request.urlopen(req) as res:
-        response = res.read().decode()
-
-    return response
-
-def get(url, headers={}):
-    return request('GET', url, None, headers)
-
-def post(url, data, headers={}):
-    return request('POST', url, data, headers)
-
-
 class TrustedPublishingError(Exception):
     pass
 
@@ -50,9 +24,15 @@ class TrustedPublishingProvider:
 
     def get_token(self, repository):
         """Perform the whole song and dance to get a token."""
+        return self.mint_token(repository)["token"]
+
+    def mint_token(self, repository):
+        """Exchange the ambient credential for a token, returning the repository's whole response."""
         url = urlsplit(repository)._replace(path="/_/oidc/mint-token").geturl()
-        data = json.loads(post(url, {"token": self.get_ambient_credential()}))
-        return data["token"]
+        # The ambient credential can only be used once: if the repository accepted it but the
+        # response was lost, retrying would fail, hiding what happened. So it's only retried if
+        # the repository rejected it without processing it (see http.request).
+        return http.request("POST", url, body={"token": self.get_ambient_credential()}).json()
 
     def get_ambient_credential(self):
         """Get the "ambient credential" from the provider."""
@@ -78,28 +58,60 @@ class GithubTrustedPublishing(TrustedPublishingProvider):
 
         headers = {"Authorization": f"bearer {token}"}
 
-        data = json.loads(get(url, headers))
+        data = http.get(url, headers=headers).json()
         oidc_token = data['value']
         return oidc_token
 
 
 PROVIDERS = [GithubTrustedPublishing]
 
+# How long tokens are valid for, in seconds, if the repository doesn't say. (PyPI's last 15 minutes.)
+TOKEN_LIFETIME = 15 * 60
+
+# Tokens are minted again this many seconds before they expire, rather than risk them expiring while in use.
+EXPIRY_MARGIN = 60
+
+# Tokens minted during this process, with when they expire, per repository
+_tokens: dict[str, tuple[str, float]] = {}
+_tokens_lock = Lock()
+
 def get_token(repository):
-    """Given the URL for a repository, get a token to publish to that repository."""
+    """Given the URL for a repository, get a token to publish to that repository.
+
+    Tokens are reused (for the same repository) until shortly before they expire.
+    """
     log = logger()
 
-    audience = get_audience(repository)
     for provider in PROVIDERS:
         if provider.detected():
             log.debug(f"found Trusted Publisher: {provider.__name__}")
-            return provider(audience).get_token(repository)
-    log.debug("couldn't find any known Trusted Publisher")
-    return None
-
+            break
+    else:
+        log.debug("couldn't find any known Trusted Publisher")
+        return None
+
+    # Uploads running concurrently all ask for a token, which only needs minting once.
+    with _tokens_lock:
+        token, expires = _tokens.get(repository, (None, 0.0))
+        if token is not None and time.time() < expires - EXPIRY_MARGIN:
+            return token
+
+        now = time.time()
+        data = provider(get_audience(repository)).mint_token(repository)
+        token, expires = data["token"], data.get("expires")
+        if not isinstance(expires, (int, float)):  # Seconds since the epoch, if given
+            expires = now + TOKEN_LIFETIME
+        _tokens[repository] = (token, expires)
+        log.debug(f"minted a token for {repository!r}")
+        return token
+
+@cache
 def get_audience(repository):
-    """Given the full URL for a repository, determine the OIDC audience."""
+    """Given the full URL for a repository, determine the OIDC audience.
+
+    The audience is only looked up once per repository.
+    """
     url = urlsplit(repository)._replace(path="/_/oidc/audience").geturl()
-    audience = json.loads(get(url))["audience"]
+    audience = http.get(url).json()["audience"]
     logger().debug(f"repository {repository!r} has audience {audience!r}")
     return audience
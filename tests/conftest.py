@@ -1,5 +1,5 @@
 from pathlib import Path
-import shutil
+import os, shutil
 
 import pytest
 
@@ -16,6 +16,15 @@ def _src_name(src):
 
 test_dir = Path(__file__).parent
 
+@pytest.fixture(scope="session", autouse=True)
+def cache_root(tmp_path_factory):
+    """Keep Bork's cache isolated from the user's, but shared over the whole pytest run."""
+    path = tmp_path_factory.mktemp("cache")
+    os.environ["BORK_CACHE_DIR"] = str(path)
+    yield path
+    del os.environ["BORK_CACHE_DIR"]
+
+
 @pytest.fixture(scope="session", ids=_src_name, params=(
     test_dir / 'fixtures' / 'minimal-package',
     test_dir / 'fixtures' / 'poetry-package',
@@ -0,0 +1,37 @@
+import zipfile
+from functools import partial
+
+import pytest
+
+from bork import archive
+
+
+def test_concurrently(tmp_path):
+    "Ensure entries produced concurrently are written in order, with the requested compression"
+    def produce(i):
+        if i % 10 == 3:
+            return None
+        return archive.Entry.from_bytes(f"{i}.txt", b"x" * 1000, compresslevel = i % 2 * 9)
+
+    target = tmp_path / "test.zip"
+    archive.write(target, archive.concurrently(
+        (partial(produce, i) for i in range(100)), workers = 4,
+    ), prefix = b"#!/usr/bin/env python3\n")
+
+    with zipfile.ZipFile(target) as zf:
+        assert zf.testzip() is None
+        assert zf.namelist() == [f"{i}.txt" for i in range(100) if i % 10 != 3]
+        assert all(
+            info.compress_type == (zipfile.ZIP_DEFLATED if int(info.filename[:-4]) % 2 else zipfile.ZIP_STORED)
+            for info in zf.infolist()
+        )
+
+
+def test_too_many_members(tmp_path, monkeypatch):
+    "Ensure archives which would need ZIP64 are rejected, rather than written corrupted"
+    monkeypatch.setattr(archive, "_ZIP32_MAX_MEMBERS", 3)
+    entries = [archive.Entry.from_bytes(f"{i}.txt", b"") for i in range(4)]
+
+    archive.write(tmp_path / "ok.zip", entries[:3])
+    with pytest.raises(ValueError, match = "Too many archive members"):
+        archive.write(tmp_path / "too-many.zip", entries)
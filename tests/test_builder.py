@@ -2,10 +2,13 @@ from functools import partial
 from pathlib import Path
 from random import shuffle
 from typing import Literal
-import logging
+import logging, shutil
+
+import pytest
 
 from bork import builder
-from helpers import chdir
+from bork.filesystem import dist_metadata
+from helpers import check_zipfile, chdir
 
 def is_beneath(child: Path, parent: Path) -> Path | Literal[False]:
     try:
@@ -71,3 +74,130 @@ def test_builder_order(project_src, tmp_path):
     with builder.prepare(project_src, dst) as b:
         for phase in phases:
             phase(b)
+
+
+def test_builder_env_cache(project_src, tmp_path):
+    "Ensure that isolated environments are reused, unless caching is disabled"
+    dst = tmp_path / 'dist'
+
+    with builder.prepare(project_src, dst) as b:
+        cached = b.env.path
+        assert cached.with_name(cached.name + ".ready").exists()
+
+    with builder.prepare(project_src, dst) as b:
+        assert b.env.path == cached
+
+    with builder.prepare(project_src, dst, cache = False) as b:
+        fresh = b.env.path
+        assert fresh != cached
+
+    assert not fresh.exists()
+
+
+def test_builder_zipapp_reuses_wheel(project_src, tmp_path, monkeypatch):
+    "Ensure that building a zipapp reuses the wheel previously built by the same builder"
+    dst = (tmp_path / 'dist').resolve()
+
+    with builder.prepare(project_src, dst) as b:
+        _artefact(dst, b.build("wheel"), ".whl")
+
+        def no_rebuild(dist, *args, **kwargs):
+            raise AssertionError(f"Rebuilt {dist}")
+
+        monkeypatch.setattr(b.bld, "build", no_rebuild)
+        pyz = b.zipapp("src:main")
+
+    _artefact(dst, pyz, ".pyz")
+    assert check_zipfile(pyz)
+
+
+def test_builder_metadata(project_src, tmp_path, monkeypatch):
+    "Ensure that metadata is built once, and matches the metadata of built artefacts"
+    dst = (tmp_path / 'dist').resolve()
+
+    with builder.prepare(project_src, dst) as b:
+        meta = b.metadata()
+
+        def no_rebuild(*args, **kwargs):
+            raise AssertionError("Rebuilt metadata")
+
+        with monkeypatch.context() as m:
+            m.setattr(b.bld, "metadata_path", no_rebuild)
+            assert b.metadata().json == meta.json
+
+        for dist in ("sdist", "wheel"):
+            built = dist_metadata(b.build(dist))
+            for k in ("name", "version"):
+                assert built[k] == meta[k]
+
+
+def test_builder_incremental(project, monkeypatch):
+    "Ensure that up-to-date artefacts are reused, unless the source tree changed"
+    dst = project / 'dist'
+
+    with builder.prepare(project, dst) as b:
+        artefacts = {dist: b.build(dist) for dist in ("sdist", "wheel")}
+
+    def no_rebuild(dist, *args, **kwargs):
+        raise AssertionError(f"Rebuilt {dist}")
+
+    with builder.prepare(project, dst) as b:
+        with monkeypatch.context() as m:
+            m.setattr(b.bld, "build", no_rebuild)
+            for dist, artefact in artefacts.items():
+                assert b.build(dist) == artefact
+
+    (project / "new-file.txt").write_text("Changes!")
+
+    with builder.prepare(project, dst) as b:
+        with monkeypatch.context() as m:
+            m.setattr(b.bld, "build", no_rebuild)
+            with pytest.raises(AssertionError, match = "Rebuilt sdist"):
+                b.build("sdist")
+
+    with builder.prepare(project, dst, cache = False) as b:
+        with monkeypatch.context() as m:
+            m.setattr(b.bld, "build", no_rebuild)
+            with pytest.raises(AssertionError, match = "Rebuilt wheel"):
+                b.build("wheel")
+
+
+@pytest.mark.parametrize("parallel, from_sdist", ((True, False), (False, True), (True, True)))
+def test_builder_build_all(project_src, tmp_path, monkeypatch, parallel, from_sdist):
+    "Ensure that concurrent builds produce the same wheel as sequential ones"
+    monkeypatch.setenv("SOURCE_DATE_EPOCH", "1700000000")
+
+    with builder.prepare(project_src, tmp_path / 'serial') as b:
+        serial = b.build_all()
+
+    dst = (tmp_path / 'concurrent').resolve()
+    with builder.prepare(project_src, dst) as b:
+        built = b.build_all(parallel = parallel, from_sdist = from_sdist)
+
+    _artefact(dst, built["sdist"], ".tar.gz")
+    _artefact(dst, built["wheel"], ".whl")
+    assert built["sdist"].name == serial["sdist"].name
+
+    if not from_sdist:  # The sdist may not include everything the source tree does
+        assert built["wheel"].read_bytes() == serial["wheel"].read_bytes()
+
+
+def test_builder_zipapps(tmp_path):
+    "Ensure that all configured zipapp targets are built, and reused once up-to-date"
+    src = tmp_path / 'src'
+    shutil.copytree(Path(__file__).parent / 'fixtures' / 'minimal-package', src,
+                    ignore = shutil.ignore_patterns('build', '*.egg-info'))
+    with (src / 'pyproject.toml').open('a') as f:
+        f.write('\n[tool.bork.zipapp.targets.one]\nmain = "src:main"\n'
+                '\n[tool.bork.zipapp.targets.two]\nmain = "src:main"\npython_interpreter = "/usr/bin/python3"\n')
+
+    dst = tmp_path / 'dist'
+    with builder.prepare(src, dst) as b:
+        zipapps = b.zipapps()
+        assert [z.name for z in zipapps] == ["one-0.pyz", "two-0.pyz"]
+        assert zipapps[1].read_bytes().startswith(b"#!/usr/bin/python3\n")
+        for z in zipapps:
+            assert check_zipfile(z)
+
+        assert b.zipapps() == zipapps
+        assert [z.name for z in b.zipapps("src:main")] == ["test-project-please-ignore-0.pyz", *(z.name for z in zipapps)]
@@ -0,0 +1,29 @@
+import os
+
+from bork import cache
+
+
+def test_evict_lru(tmp_path):
+    entries = [tmp_path / name for name in ("old", "mid", "new")]
+    for age, entry in enumerate(reversed(entries)):
+        entry.mkdir()
+        (entry / "data").write_bytes(b"x" * 100)
+        os.utime(entry, (1000 - age, 1000 - age))
+
+    cache.evict(tmp_path, max_entries = 2)
+    assert [e.exists() for e in entries] == [False, True, True]
+
+    cache.evict(tmp_path, max_bytes = 150)
+    assert [e.exists() for e in entries] == [False, False, True]
+
+
+def test_evict_skips_locked(tmp_path):
+    entry = tmp_path / "entry"
+    entry.mkdir()
+
+    with cache.lock_for(entry):
+        cache.evict(tmp_path, max_entries = 0)
+        assert entry.exists()
+
+    cache.evict(tmp_path, max_entries = 0)
+    assert not entry.exists()
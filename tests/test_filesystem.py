@@ -0,0 +1,56 @@
+import pytest
+
+from bork.filesystem import _git, copy_sources, fingerprint
+from helpers import chdir, check_run
+
+
+def git(*args):
+    check_run(["git", "-c", "user.name=bork", "-c", "user.email=bork@example.com", *args])
+
+
+def test_fingerprint_git(tmp_path):
+    "Ensure that committing and tagging change the fingerprint, as they may change the version built"
+    with chdir(tmp_path):
+        git("init", "-q")
+        (tmp_path / "pyproject.toml").write_text("[project]\n")
+        fingerprints = [fingerprint(tmp_path)]
+
+        git("add", "pyproject.toml")
+        fingerprints.append(fingerprint(tmp_path))
+        git("commit", "-q", "-m", "Initial commit")
+        fingerprints.append(fingerprint(tmp_path))
+        git("tag", "v1.0.0")
+        fingerprints.append(fingerprint(tmp_path))
+
+        assert len(set(fingerprints)) == len(fingerprints)
+        assert fingerprint(tmp_path) == fingerprints[-1]
+
+
+def test_copy_sources_git(tmp_path):
+    "Ensure that git sees a copy of a working tree exactly as it sees the working tree"
+    src, dst = tmp_path / "src", tmp_path / "copy"
+
+    src.mkdir()
+    with chdir(src):
+        git("init", "-q")
+        for name in (".github/workflows/ci.yml", ".gitignore", "pkg/__init__.py", "pyproject.toml"):
+            (src / name).parent.mkdir(parents = True, exist_ok = True)
+            (src / name).write_text("ignored.txt\n" if name == ".gitignore" else "")
+        git("add", ".")
+        git("commit", "-q", "-m", "Initial commit")
+        git("tag", "v1.0.0")
+
+        (src / "pkg" / "__init__.py").write_text("Modified")
+        (src / "untracked.py").write_text("Untracked")
+        (src / "ignored.txt").write_text("Ignored")
+        status = _git(src, "status", "--porcelain")
+
+    copy_sources(src, dst)
+    assert (dst / ".github" / "workflows" / "ci.yml").exists()
+    assert (dst / "untracked.py").exists()
+    assert not (dst / "ignored.txt").exists()
+    assert _git(dst, "status", "--porcelain") == status
+    assert _git(dst, "describe", "--tags", "--dirty") == _git(src, "describe", "--tags", "--dirty")
+
+    with pytest.raises(ValueError, match = "subdirectory"):
+        copy_sources(src / "pkg", tmp_path / "pkg-copy")
@@ -0,0 +1,225 @@
+from bork import http
+from bork.github_api import GithubApi
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from urllib.parse import parse_qs, urlsplit
+import hashlib, json, logging
+
+
+class FakeGithub(BaseHTTPRequestHandler):
+    """Just enough of GitHub's API to upload release assets"""
+    protocol_version = "HTTP/1.1"
+    lock = Lock()
+    releases: list[dict] = []
+    assets: dict[str, dict] = {}
+    pulls: list[dict] = []
+    searches: list[dict] = []
+    incomplete = False  # Whether searches time out
+    patches: list[dict] = []
+    fail: set[str] = set()  # Assets whose next upload fails, after being partially stored
+
+    def respond(self, status, body=None):
+        data = json.dumps(body).encode() if body is not None else b""
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        name = parse_qs(url.query)["name"][0]
+        data = self.rfile.read(int(self.headers["Content-Length"]))
+        with self.lock:
+            if name in self.assets:
+                return self.respond(422, {"errors": [{"code": "already_exists"}]})
+            asset = self.assets[name] = {
+                "id": max((a["id"] for a in self.assets.values()), default = 0) + 1,
+                "name": name, "size": len(data), "state": "uploaded",
+                "digest": "sha256:" + hashlib.sha256(data).hexdigest(),
+            }
+            if name in self.fail:
+                self.fail.remove(name)
+                asset["state"] = "starter"
+                return self.respond(502)
+        self.respond(201, asset)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        with self.lock:
+            if url.path == "/search/issues":
+                query = {k: v[0] for k, v in parse_qs(url.query).items()}
+                self.searches.append(query)
+                size, page = int(query["per_page"]), int(query["page"])
+                items = self.pulls[(page - 1) * size:page * size]
+                self.respond(200, {"total_count": len(self.pulls), "incomplete_results": self.incomplete, "items": items})
+            elif "/assets" in self.path:
+                self.respond(200, list(self.assets.values()))
+            else:
+                self.respond(200, self.releases)
+
+    def do_PATCH(self):
+        release_id = int(self.path.rsplit("/", 1)[-1])
+        changes = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with self.lock:
+            self.patches.append(changes)
+            release = next(r for r in self.releases if r["id"] == release_id)
+            release.update(changes)
+        self.respond(200, release)
+
+    def do_DELETE(self):
+        asset_id = int(self.path.rsplit("/", 1)[-1])
+        with self.lock:
+            for name, asset in list(self.assets.items()):
+                if asset["id"] == asset_id:
+                    del self.assets[name]
+        self.respond(204)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_upload_assets(monkeypatch, tmp_path, caplog):
+    monkeypatch.setattr(http, "_retry_policy", http.RetryPolicy(retries = 2, backoff = 0))
+    monkeypatch.setattr(http.FileBody, "CHUNK_SIZE", 64 * 1024)
+    FakeGithub.assets, FakeGithub.fail = {}, {"flaky.bin"}
+
+    assets = {}
+    for name, size in (("small.bin", 10), ("flaky.bin", 100_000), ("big.bin", 1_000_000)):
+        (tmp_path / name).write_bytes(b"x" * size)
+        assets[str(tmp_path / name)] = name
+
+    with ThreadingHTTPServer(("127.0.0.1", 0), FakeGithub) as server:
+        Thread(target = server.serve_forever, daemon = True).start()
+        api = GithubApi("owner", "repo", "project", "token")
+        api.API_URL = f"http://127.0.0.1:{server.server_port}"
+        api.PROGRESS_INTERVAL = 0
+        release = {"id": 1, "upload_url": f"{api.API_URL}/upload{{?name,label}}"}
+
+        with caplog.at_level(logging.INFO):
+            api.upload_assets(release, assets, workers = 3)
+        server.shutdown()
+
+    assert {a["name"]: a["size"] for a in FakeGithub.assets.values()} == {"small.bin": 10, "flaky.bin": 100_000, "big.bin": 1_000_000}
+    assert all(a["state"] == "uploaded" for a in FakeGithub.assets.values())
+    assert any(m.startswith("Uploading asset big.bin: ") for m in caplog.messages)
+    # The failed upload was retried once, after deleting what it left.
+    assert sum("flaky.bin failed" in m and "retrying" in m for m in caplog.messages) == 1
+    assert "Deleting asset flaky.bin from release." in caplog.messages
+    assert any(m.startswith("Uploaded asset big.bin: 1.0 MiB in ") for m in caplog.messages)
+
+
+def test_resume_release(tmp_path, caplog):
+    assets = {}
+    for name in ("same.bin", "changed.bin", "partial.bin", "missing.bin"):
+        (tmp_path / name).write_bytes(name.encode())
+        assets[str(tmp_path / name)] = name
+
+    def asset(id, name, data, state = "uploaded"):
+        return {"id": id, "name": name, "size": len(data), "state": state,
+                "digest": "sha256:" + hashlib.sha256(data).hexdigest()}
+
+    FakeGithub.assets = {
+        "same.bin": asset(1, "same.bin", b"same.bin"),
+        "changed.bin": asset(2, "changed.bin", b"CHANGED.bin"),  # Same size, different digest
+        "partial.bin": asset(3, "partial.bin", b"part", state = "starter"),
+    }
+    FakeGithub.fail = set()
+
+    with ThreadingHTTPServer(("127.0.0.1", 0), FakeGithub) as server:
+        Thread(target = server.serve_forever, daemon = True).start()
+        api = GithubApi("owner", "repo", "project", "token")
+        api.API_URL = f"http://127.0.0.1:{server.server_port}"
+        draft = {"id": 7, "tag_name": "v1.0.0", "target_commitish": "0123abcd", "name": "project v1.0.0",
+                 "body": "Release notes", "draft": True, "prerelease": False,
+                 "html_url": "https://github.com/owner/repo/releases/7", "upload_url": f"{api.API_URL}/upload{{?name,label}}"}
+        FakeGithub.releases = [draft, {"id": 6, "tag_name": "v0.9.0", "draft": False}]
+        FakeGithub.patches = []
+
+        with caplog.at_level(logging.INFO):
+            assert api.create_release("v1.0.0", commitish = "0123abcd", body = "Release notes", assets = assets) == draft
+        server.shutdown()
+
+    assert FakeGithub.patches == []
+
+    # Only the assets which were missing or differed were uploaded.
+    assert FakeGithub.assets["same.bin"]["id"] == 1
+    assert {a["name"]: a["size"] for a in FakeGithub.assets.values()} == {n: len(n) for n in assets.values()}
+    assert all(a["state"] == "uploaded" for a in FakeGithub.assets.values())
+    assert sum(m.startswith("Adding asset") for m in caplog.messages) == 3
+
+
+def test_resume_release_other_commit(tmp_path):
+    (tmp_path / "asset.bin").write_bytes(b"new")
+    FakeGithub.assets, FakeGithub.fail = {"asset.bin": {"id": 1, "name": "asset.bin", "size": 3, "state": "uploaded",
+                                                        "digest": "sha256:" + hashlib.sha256(b"old").hexdigest()}}, set()
+
+    with ThreadingHTTPServer(("127.0.0.1", 0), FakeGithub) as server:
+        Thread(target = server.serve_forever, daemon = True).start()
+        api = GithubApi("owner", "repo", "project", "token")
+        api.API_URL = f"http://127.0.0.1:{server.server_port}"
+        draft = {"id": 7, "tag_name": "v1.0.0", "target_commitish": "0123abcd", "name": "project v1.0.0",
+                 "body": "Old release notes", "draft": True, "prerelease": False,
+                 "html_url": "https://github.com/owner/repo/releases/7", "upload_url": f"{api.API_URL}/upload{{?name,label}}"}
+        FakeGithub.releases = [draft]
+        FakeGithub.patches = []
+
+        release = api.create_release("v1.0.0", commitish = "4567cdef", body = "Release notes",
+                                     assets = {str(tmp_path / "asset.bin"): "asset.bin"})
+        server.shutdown()
+
+    # The draft is updated to match the release being made, and its outdated asset replaced.
+    assert FakeGithub.patches == [{"target_commitish": "4567cdef", "body": "Release notes"}]
+    assert release["id"] == 7 and release["target_commitish"] == "4567cdef"
+    assert FakeGithub.assets["asset.bin"]["digest"] == "sha256:" + hashlib.sha256(b"new").hexdigest()
+
+
+def test_changelog(monkeypatch, tmp_path):
+    monkeypatch.setenv("BORK_CACHE_DIR", str(tmp_path))
+    FakeGithub.releases = [
+        {"id": 3, "tag_name": "v2.0.0", "draft": True},
+        {"id": 2, "tag_name": "v1.0.0", "draft": False, "created_at": "2024-01-01T00:00:00Z"},
+    ]
+    FakeGithub.pulls = [{"title": f"PR {n}", "number": n, "user": {"login": "someone"}} for n in range(250, 0, -1)]
+    FakeGithub.searches = []
+
+    with ThreadingHTTPServer(("127.0.0.1", 0), FakeGithub) as server:
+        Thread(target = server.serve_forever, daemon = True).start()
+        api = GithubApi("owner", "repo", "project", "token")
+        api.API_URL = f"http://127.0.0.1:{server.server_port}"
+        monkeypatch.setattr(api, "run", lambda *command: "0123abcd")
+
+        changelog = api.changelog()
+        assert len(FakeGithub.searches) == 3
+        assert {s["q"] for s in FakeGithub.searches} == {"repo:owner/repo is:pr is:merged merged:>2024-01-01T00:00:00Z"}
+
+        # Changelogs are cached, per commit.
+        again = GithubApi("owner", "repo", "project", "token")
+        again.API_URL = "http://unreachable.invalid"
+        monkeypatch.setattr(again, "run", lambda *command: "0123abcd")
+        assert again.changelog() == changelog
+        server.shutdown()
+
+    lines = changelog.splitlines()
+    assert len(lines) == 250
+    assert lines[0] == "* PR 250 (#250 by @someone)"
+    assert lines[-1] == "* PR 1 (#1 by @someone)"
+
+
+def test_changelog_incomplete(monkeypatch, tmp_path):
+    monkeypatch.setenv("BORK_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(FakeGithub, "incomplete", True)
+    FakeGithub.releases = []
+    FakeGithub.pulls = [{"title": "PR 1", "number": 1, "user": {"login": "someone"}}]
+    FakeGithub.searches = []
+
+    with ThreadingHTTPServer(("127.0.0.1", 0), FakeGithub) as server:
+        Thread(target = server.serve_forever, daemon = True).start()
+        api = GithubApi("owner", "repo", "project", "token")
+        api.API_URL = f"http://127.0.0.1:{server.server_port}"
+        monkeypatch.setattr(api, "run", lambda *command: "0123abcd")
+
+        # Changelogs which may be incomplete aren't cached.
+        assert api.changelog() == api.changelog() == "* PR 1 (#1 by @someone)"
+        assert len(FakeGithub.searches) == 2
+        server.shutdown()
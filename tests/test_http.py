@@ -0,0 +1,200 @@
+from bork import http
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from threading import Thread
+import gzip, json, pytest, time, urllib3
+
+
+def test_multipart(tmp_path):
+    data = bytes(range(256)) * 10_000
+    (tmp_path / "big.whl").write_bytes(data)
+
+    fields = [
+        (":action", "file_upload"),
+        ("summary", "Ünïcode"),
+        ("content", ("big.whl", tmp_path / "big.whl", "application/octet-stream")),
+    ]
+    body = http.Multipart(fields)
+    expected, content_type = urllib3.encode_multipart_formdata(
+        [(k, (v[0], Path(v[1]).read_bytes(), v[2]) if isinstance(v, tuple) else v) for (k, v) in fields],
+        boundary = body.boundary,
+    )
+
+    assert body.content_type == content_type
+    assert len(body) == len(expected)
+    assert b"".join(body) == expected
+    assert max(map(len, body)) <= http.FileBody.CHUNK_SIZE
+
+
+def test_post_multipart(tmp_path):
+    received = {}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            received["headers"] = self.headers
+            received["body"] = self.rfile.read(int(self.headers["Content-Length"]))
+            self.send_response(200)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    (tmp_path / "dist.tar.gz").write_bytes(b"x" * 3_000_000)
+    body = http.Multipart([("content", ("dist.tar.gz", tmp_path / "dist.tar.gz", "application/octet-stream"))])
+
+    with ThreadingHTTPServer(("127.0.0.1", 0), Handler) as server:
+        Thread(target = server.serve_forever, daemon = True).start()
+        response = http.post(f"http://127.0.0.1:{server.server_port}/", auth = ("user", "pass"), body = body)
+        server.shutdown()
+
+    assert response.status == 200
+    assert "Transfer-Encoding" not in received["headers"]
+    assert received["headers"]["Content-Type"] == body.content_type
+    assert received["body"] == b"".join(body)
+
+
+def test_keep_alive():
+    connections = set()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            connections.add(self.client_address)
+            self.send_response(200)
+            self.send_header("Content-Length", "2")
+            self.end_headers()
+            self.wfile.write(b"ok")
+
+        def log_message(self, *args):
+            pass
+
+    with ThreadingHTTPServer(("127.0.0.1", 0), Handler) as server:
+        Thread(target = server.serve_forever, daemon = True).start()
+        for _ in range(3):
+            assert http.get(f"http://127.0.0.1:{server.server_port}/").data == b"ok"
+        server.shutdown()
+
+    assert len(connections) == 1
+
+
+def test_json_gzip():
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            assert self.headers["Content-Type"] == "application/json"
+            assert self.headers["User-Agent"] == http.USER_AGENT
+            assert "gzip" in self.headers["Accept-Encoding"]
+
+            body = gzip.compress(json.dumps({"echo": request}).encode())
+            self.send_response(200)
+            self.send_header("Content-Encoding", "gzip")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    with ThreadingHTTPServer(("127.0.0.1", 0), Handler) as server:
+        Thread(target = server.serve_forever, daemon = True).start()
+        response = http.post(f"http://127.0.0.1:{server.server_port}/", body = {"token": "abc"})
+        server.shutdown()
+
+    assert response.json() == {"echo": {"token": "abc"}}
+
+
+def test_retry():
+    statuses = []
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        responses = []
+
+        def respond(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            status, headers = Handler.responses.pop(0)
+            statuses.append((self.command, status))
+            self.send_response(status)
+            for header in headers.items():
+                self.send_header(*header)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        do_GET = do_POST = respond
+
+        def log_message(self, *args):
+            pass
+
+    policy = http.RetryPolicy(retries = 2, backoff = 0)
+    with ThreadingHTTPServer(("127.0.0.1", 0), Handler) as server:
+        Thread(target = server.serve_forever, daemon = True).start()
+        url = f"http://127.0.0.1:{server.server_port}/"
+
+        # Transient errors are retried for idempotent requests...
+        Handler.responses = [(502, {}), (504, {}), (200, {})]
+        assert http.request("GET", url, retry = policy).status == 200
+
+        # ... but not for others, unless the server rejected the request.
+        Handler.responses = [(502, {})]
+        with pytest.raises(http.HTTPError):
+            http.request("POST", url, body = b"data", retry = policy)
+
+        Handler.responses = [(503, {"Retry-After": "0"}), (403, {"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": "0"}), (200, {})]
+        assert http.request("POST", url, body = b"data", retry = policy).status == 200
+
+        # Requests are retried at most `retries` times.
+        Handler.responses = [(500, {})] * 3
+        with pytest.raises(http.HTTPError):
+            http.request("GET", url, retry = policy)
+        server.shutdown()
+
+    assert [s for (_, s) in statuses] == [502, 504, 200, 502, 503, 403, 200, 500, 500, 500]
+
+
+def test_retry_delay():
+    policy = http.RetryPolicy(backoff = 1, max_backoff = 5)
+    assert all(0 <= policy.delay(n) <= min(5, 2 ** n) for n in range(10) for _ in range(10))
+
+    class Response:
+        def __init__(self, **headers):
+            self.headers = urllib3.HTTPHeaderDict(headers)
+
+    assert policy.delay(0, Response(**{"Retry-After": "120"})) == 120
+    assert 0 < policy.delay(0, Response(**{"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": str(int(time.time()) + 30)})) <= 31
+    assert 0 <= policy.delay(0, Response(**{"X-RateLimit-Remaining": "10", "X-RateLimit-Reset": "0"})) <= 1
+
+
+def test_redirect(tmp_path):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def respond(self):
+            data = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            if self.path.startswith("/old"):
+                status, body = {"/old-301": 301, "/old-308": 308}[self.path], b""
+                self.send_response(status)
+                self.send_header("Location", "/new")
+            else:
+                body = f"{self.command} ".encode() + data
+                self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        do_GET = do_POST = respond
+
+        def log_message(self, *args):
+            pass
+
+    (tmp_path / "data").write_bytes(b"abcd")
+    with ThreadingHTTPServer(("127.0.0.1", 0), Handler) as server:
+        Thread(target = server.serve_forever, daemon = True).start()
+        url = f"http://127.0.0.1:{server.server_port}"
+
+        assert http.get(f"{url}/old-301").data == b"GET "
+        # 307 and 308 redirects keep the method and body.
+        assert http.post(f"{url}/old-308", body = http.FileBody(tmp_path / "data")).data == b"POST abcd"
+        server.shutdown()
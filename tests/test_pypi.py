@@ -0,0 +1,66 @@
+from bork import pypi
+
+from threading import Barrier
+from types import SimpleNamespace
+import hashlib, pytest
+
+
+def test_upload_concurrently(monkeypatch):
+    monkeypatch.setenv("BORK_PYPI_TOKEN", "pypi-token")
+    files = [f"dist/pkg-1.0-py{n}-none-any.whl" for n in range(4)]
+    # Each upload waits for the others to have started, so this only passes if they're concurrent.
+    barrier = Barrier(len(files), timeout = 10)
+
+    def upload_file(self, url, file, metadata, auth):
+        assert auth == ("__token__", "pypi-token")
+        barrier.wait()
+        if file == files[2]:
+            return SimpleNamespace(status = 400, data = b"File already exists.")
+        return SimpleNamespace(status = 200, data = b"")
+
+    monkeypatch.setattr(pypi.Uploader, "_upload_file", upload_file)
+    # Credentials are resolved once per call to upload, rather than for each file.
+    resolved = []
+    credentials = pypi.Uploader._credentials
+    monkeypatch.setattr(pypi.Uploader, "_credentials", lambda self: resolved.append(1) or credentials(self))
+
+    with pytest.raises(RuntimeError, match = r"Failed to upload 1 of 4 files .*: pkg-1.0-py2-none-any.whl$"):
+        pypi.Uploader(files, "testpypi").upload(dry_run = False, metadata = {"Name": "pkg"}, workers = len(files))
+
+    uploaded = files[:2] + files[3:]
+    barrier = Barrier(len(uploaded), timeout = 10)
+    results = pypi.Uploader(uploaded, "testpypi").upload(dry_run = False, metadata = {"Name": "pkg"}, workers = len(uploaded))
+    assert results == dict.fromkeys(uploaded)
+    assert len(resolved) == 2
+
+
+def test_upload_skip_existing(monkeypatch, tmp_path):
+    monkeypatch.setenv("BORK_PYPI_TOKEN", "pypi-token")
+    files = {name: tmp_path / name for name in ("pkg-1.0.tar.gz", "pkg-1.0-py3-none-any.whl", "pkg-1.0-cp311-none-any.whl")}
+    for name, path in files.items():
+        path.write_bytes(name.encode())
+
+    uploaded = []
+    monkeypatch.setattr(pypi.Uploader, "_upload_file",
+                        lambda self, url, file, metadata, auth: uploaded.append(file) or SimpleNamespace(status = 200))
+    monkeypatch.setattr(pypi.Uploader, "existing_files", lambda self, project: {
+        "pkg-1.0.tar.gz": hashlib.sha256(b"pkg-1.0.tar.gz").hexdigest(),
+    })
+
+    uploader = pypi.Uploader(list(map(str, files.values())), "pypi")
+    assert set(uploader.upload(dry_run = False, metadata = {"Name": "pkg"}, skip_existing = True)) == set(uploader.files)
+    assert sorted(uploaded) == sorted(str(files[n]) for n in files if n.endswith(".whl"))
+
+    # A different file with the same name can't be uploaded.
+    files["pkg-1.0.tar.gz"].write_bytes(b"changed")
+    with pytest.raises(RuntimeError, match = r"Failed to upload 1 of 3 files .*: pkg-1.0.tar.gz$"):
+        uploader.upload(dry_run = False, metadata = {"Name": "pkg"}, skip_existing = True)
+
+
+def test_simple_index_links():
+    links = pypi._SimpleIndexLinks()
+    links.feed("""<!DOCTYPE html><html><body>
+        <a href="../../packages/ab/cd/pkg-1.0.tar.gz#sha256=0123abcd" data-requires-python="&gt;=3.11">pkg-1.0.tar.gz</a>
+        <a href="https://files.example.com/pkg-1.0%2Blocal-py3-none-any.whl#md5=ffff">pkg-1.0+local-py3-none-any.whl</a>
+    </body></html>""")
+    assert links.files == {"pkg-1.0.tar.gz": "0123abcd", "pkg-1.0+local-py3-none-any.whl": None}
@@ -0,0 +1,255 @@
+import os, subprocess, sys, time, zipfile
+from pathlib import Path
+
+import pytest
+
+from bork import builder, pyz
+
+
+def test_lock_dependencies(project_src, tmp_path, monkeypatch):
+    "Ensure that dependencies are only resolved when the wheel's requirements change"
+    with builder.prepare(project_src, tmp_path / 'dist') as b:
+        wheel = b.build("wheel")
+
+    lock_file = tmp_path / "zipapp.lock"
+    pins = pyz.lock_dependencies(wheel, lock_file)
+    assert lock_file.exists()
+
+    def no_resolve(*args):
+        raise AssertionError("Resolved dependencies again")
+
+    monkeypatch.setattr(pyz, "_pip", no_resolve)
+    assert pyz.lock_dependencies(wheel, lock_file) == pins
+
+    lock_file.write_text(lock_file.read_text().replace("# input: ", "# input: outdated"))
+    if pins:
+        with pytest.raises(AssertionError):
+            pyz.lock_dependencies(wheel, lock_file)
+
+
+def _wheel(path, members):
+    with zipfile.ZipFile(path, "w") as zf:
+        for name, data in members.items():
+            zf.writestr(name, data, compress_type = zipfile.ZIP_STORED if name.endswith(".txt") else zipfile.ZIP_DEFLATED)
+    return path
+
+
+def test_assemble(tmp_path):
+    "Ensure zipapps are assembled from wheels, mapping .data directories and copying members as-is"
+    dep = _wheel(tmp_path / "dep-1.0-py3-none-any.whl", {
+        "dep-1.0.dist-info/METADATA": "Name: dep\nVersion: 1.0\n",
+        "dep-1.0.data/purelib/dep.py": "VALUE = 'dep'\n",
+        "dep-1.0.data/platlib/dep_ext.py": "VALUE = 'ext'\n",
+        "dep-1.0.data/scripts/dep": "#!python\n",
+        "dep-1.0.data/data/share/dep.txt": "data",
+    })
+    app = _wheel(tmp_path / "app-1.0-py3-none-any.whl", {
+        "app-1.0.dist-info/METADATA": "Name: app\nVersion: 1.0\n",
+        "app/__init__.py": "",
+        "app/notes.txt": "stored " * 100,
+        "app/main.py": "import dep, dep_ext\ndef main():\n    print(dep.VALUE, dep_ext.VALUE)\n",
+    })
+
+    target = tmp_path / "app.pyz"
+    pyz.assemble(target, [dep, app], main = "app.main:main", interpreter = sys.executable)
+
+    with zipfile.ZipFile(target) as zf, zipfile.ZipFile(app) as src:
+        assert zf.testzip() is None
+        assert sorted(zf.namelist()) == [
+            "__main__.py", "app-1.0.dist-info/METADATA", "app/__init__.py", "app/main.py",
+            "app/notes.txt", "dep-1.0.dist-info/METADATA", "dep.py", "dep_ext.py",
+        ]
+        assert zf.getinfo("app/notes.txt").compress_type == zipfile.ZIP_DEFLATED
+        assert zf.getinfo("app/main.py").compress_size == src.getinfo("app/main.py").compress_size
+
+    assert target.read_bytes().startswith(f"#!{sys.executable}\n".encode())
+    assert subprocess.check_output((target, ), text = True) == "dep ext\n"
+
+
+def test_assemble_entry_point(tmp_path):
+    "Ensure zipapps have exactly one entry point"
+    app = _wheel(tmp_path / "app-1.0-py3-none-any.whl", {"__main__.py": "print('hi')\n"})
+
+    with pytest.raises(RuntimeError):
+        pyz.assemble(tmp_path / "app.pyz", [app], main = "app:main", interpreter = None)
+
+    pyz.assemble(tmp_path / "app.pyz", [app], main = None, interpreter = None)
+    assert subprocess.check_output((sys.executable, tmp_path / "app.pyz"), text = True) == "hi\n"
+
+    with pytest.raises(RuntimeError):
+        pyz.assemble(tmp_path / "empty.pyz", [], main = None, interpreter = None)
+
+
+@pytest.mark.parametrize("checked_hash", [True, False])
+def test_assemble_bytecode(tmp_path, checked_hash):
+    "Ensure precompiled modules are included, and used by zipimport"
+    app = _wheel(tmp_path / "app-1.0-py3-none-any.whl", {
+        "app-1.0.dist-info/METADATA": "Name: app\nVersion: 1.0\n",
+        "app/__init__.py": "",
+        "app/broken.py": "print 'Python 2'\n",
+        "app/main.py": "def main():\n    assert False, 'not optimized'\n    print('optimized')\n",
+    })
+
+    target = tmp_path / "app.pyz"
+    pyz.assemble(target, [app], main = "app.main:main", interpreter = None,
+                 optimize = 1, checked_hash = checked_hash)
+
+    with zipfile.ZipFile(target) as zf:
+        names = set(zf.namelist())
+        pyc = zf.read("app/main.pyc")
+
+    assert {"__main__.pyc", "app/__init__.pyc", "app/main.pyc"} <= names
+    assert "app/broken.pyc" not in names
+    assert int.from_bytes(pyc[4:8], "little") == (0b11 if checked_hash else 0b01)
+    assert subprocess.check_output((sys.executable, target), text = True) == "optimized\n"
+
+
+@pytest.mark.parametrize("main", ["app.main:main", None])
+def test_assemble_native(tmp_path, main):
+    "Ensure packages with native code are extracted once, and imported from Bork's cache"
+    import _json
+    if not getattr(_json, "__file__", None):
+        pytest.skip("No stdlib extension module to use as a native member")
+
+    ext = Path(_json.__file__)
+    app = _wheel(tmp_path / "app-1.0-py3-none-any.whl", {
+        "app/__init__.py": "",
+        "app/main.py": "def main():\n    from native import _json\n    print(_json.__file__)\n",
+        "native/__init__.py": "",
+        f"native/{ext.name}": ext.read_bytes(),
+        **({} if main else {"__main__.py": "from app.main import main\nmain()\n"}),
+    })
+
+    target = tmp_path / "app.pyz"
+    pyz.assemble(target, [app], main = main, interpreter = None)
+
+    env = {**os.environ, "BORK_CACHE_DIR": str(tmp_path / "cache")}
+    for _ in range(2):
+        out = Path(subprocess.check_output((sys.executable, target), text = True, env = env).strip())
+        assert out.is_relative_to(tmp_path / "cache" / "zipapps")
+        assert out.name == ext.name
+
+    assert len(list((tmp_path / "cache" / "zipapps").iterdir())) == 1
+
+
+def test_select():
+    "Ensure include/exclude patterns, strip profiles and reachability analysis select the right members"
+    sources = {
+        "__main__.py": "",
+        "app/__init__.py": "from . import cli\n",
+        "app/cli.py": "import dep.sub\nimportlib.import_module('plugin')\n",
+        "app/tests/test_cli.py": "import unused\n",
+        "app/py.typed": "",
+        "app/README.md": "",
+        "app/logo.bin": "",
+        "app-1.0.dist-info/licenses/LICENSE.md": "",
+        "dep/__init__.py": "",
+        "dep/sub.py": "",
+        "dep/__init__.pyi": "",
+        "plugin.py": "",
+        "unused/__init__.py": "",
+        "vendored/__init__.py": "",
+        "vendored/data.bin": "",
+    }
+    members = {name: zipfile.ZipInfo(name) for name in sources}
+
+    def read(name):
+        return sources[name].encode()
+
+    assert pyz.select(members, read, main = "app.cli:main", include = ["vendored/*"], exclude = ["*.bin"],
+                      strip = ["tests", "stubs", "docs"], shake = True) == {
+        "app/__init__.py", "app/cli.py", "app-1.0.dist-info/licenses/LICENSE.md",
+        "dep/__init__.py", "dep/sub.py", "plugin.py", "vendored/__init__.py", "vendored/data.bin",
+    }
+
+    assert pyz.select(members, read, main = None, shake = True) == {
+        "__main__.py", "app-1.0.dist-info/licenses/LICENSE.md",
+    }
+
+
+@pytest.mark.parametrize("epoch", [None, "1700000000"])
+def test_assemble_reproducible(tmp_path, monkeypatch, epoch):
+    "Ensure zipapps only depend on the contents of wheels, and on SOURCE_DATE_EPOCH"
+    if epoch:
+        monkeypatch.setenv("SOURCE_DATE_EPOCH", epoch)
+    else:
+        monkeypatch.delenv("SOURCE_DATE_EPOCH", raising = False)
+
+    members = {"app/__init__.py": "", "app/main.py": "def main():\n    pass\n", "app/data.txt": "data"}
+    targets = []
+    for i, (date_time, order) in enumerate((((2020, 1, 1, 0, 0, 0), 1), ((2024, 6, 1, 12, 30, 0), -1))):
+        wheel = tmp_path / str(i) / "app-1.0-py3-none-any.whl"
+        wheel.parent.mkdir()
+        with zipfile.ZipFile(wheel, "w") as zf:
+            for name, data in list(members.items())[::order]:
+                info = zipfile.ZipInfo(name, date_time)
+                info.external_attr = (0o600 if i else 0o664) << 16
+                zf.writestr(info, data, compress_type = zipfile.ZIP_DEFLATED)
+
+        targets.append(tmp_path / str(i) / "app.pyz")
+        pyz.assemble(targets[-1], [wheel], main = "app.main:main", interpreter = "/usr/bin/env python3",
+                     optimize = 0)
+
+    assert targets[0].read_bytes() == targets[1].read_bytes()
+    with zipfile.ZipFile(targets[0]) as zf:
+        assert zf.namelist() == sorted(zf.namelist())
+        expected = time.gmtime(int(epoch))[:6] if epoch else (1980, 1, 1, 0, 0, 0)
+        assert {info.date_time for info in zf.infolist()} == {expected}
+        assert {info.external_attr >> 16 for info in zf.infolist()} == {0o100644}
+
+
+def test_assemble_incremental(tmp_path, monkeypatch):
+    "Ensure rebuilding a zipapp only generates changed members, and yields the same archive as a full build"
+    members = {f"app/mod{i}.py": f"VALUE = {i}\n" for i in range(10)}
+    members["app/__init__.py"] = ""
+    members["app/main.py"] = "def main():\n    pass\n"
+
+    compiled = []
+    bytecode = pyz._bytecode
+
+    def compile(name, *args, **kwargs):
+        compiled.append(name)
+        return bytecode(name, *args, **kwargs)
+
+    monkeypatch.setattr(pyz, "_bytecode", compile)
+
+    def build(target, index = None):
+        wheel = _wheel(tmp_path / "app-1.0-py3-none-any.whl", members)
+        compiled.clear()
+        pyz.assemble(target, [wheel], main = "app.main:main", interpreter = None, optimize = 0, index = index)
+        return target.read_bytes()
+
+    index = tmp_path / "dist" / "index.json"
+    index.parent.mkdir()
+    build(tmp_path / "dist" / "app-1.0.pyz", index)
+    assert len(compiled) == 13
+
+    members["app/mod3.py"] = "VALUE = 'changed'\n"
+    incremental = build(tmp_path / "dist" / "app-1.1.pyz", index)
+    assert compiled == ["app/mod3.py"]
+    assert build(tmp_path / "full.pyz") == incremental
+
+
+def test_assemble_many(tmp_path, monkeypatch):
+    "Ensure several zipapps are assembled from the same wheels, compiling their common modules once"
+    app = _wheel(tmp_path / "app-1.0-py3-none-any.whl", {
+        "app/__init__.py": "",
+        "app/one.py": "def main():\n    print('one')\n",
+        "app/two.py": "def main():\n    print('two')\n",
+    })
+
+    compiled = []
+    bytecode = pyz._bytecode
+
+    def compile(name, *args, **kwargs):
+        compiled.append(name)
+        return bytecode(name, *args, **kwargs)
+
+    monkeypatch.setattr(pyz, "_bytecode", compile)
+
+    targets = [pyz.Target(tmp_path / f"{name}.pyz", f"app.{name}:main", None) for name in ("one", "two")]
+    pyz.assemble_many(targets, [app], optimize = 0)
+
+    assert sorted(compiled) == ["__main__.py", "__main__.py", "app/__init__.py", "app/one.py", "app/two.py"]
+    for target in targets:
+        assert subprocess.check_output((sys.executable, target.path), text = True) == f"{target.path.stem}\n"
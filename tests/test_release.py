@@ -0,0 +1,54 @@
+from threading import Event
+import logging
+
+import pytest
+
+from bork import api, github, pypi
+from helpers import chdir
+
+
+@pytest.fixture
+def release_project(tmp_path, monkeypatch):
+    """A project configured to release to PyPi and GitHub, with a wheel already built."""
+    (tmp_path / "pyproject.toml").write_text('[project]\nname = "pkg"\n\n[tool.bork.release]\n'
+                                             'pypi = true\ngithub = true\ngithub_repository = "owner/repo"\n')
+    (tmp_path / "dist").mkdir()
+    (tmp_path / "dist" / "pkg-1.0-py3-none-any.whl").write_bytes(b"")
+    monkeypatch.setenv("BORK_GITHUB_TOKEN", "github-token")
+    monkeypatch.setenv("BORK_PYPI_TOKEN", "pypi-token")
+
+    with chdir(tmp_path):
+        yield tmp_path
+
+
+@pytest.mark.parametrize("github_error, pypi_error", ((None, None), ("GitHub failed", None),
+                                                      (None, "PyPi failed"), ("GitHub failed", "PyPi failed")))
+def test_release_pipelines(release_project, monkeypatch, caplog, github_error, pypi_error):
+    "Ensure that releasing to GitHub and PyPi is concurrent, and GitHub releases are only published if both succeed"
+    calls = []
+    # Each pipeline waits for the other to have started, so this only passes if they're concurrent.
+    started = {"github": Event(), "pypi": Event()}
+
+    def pipeline(name, error):
+        started[name].set()
+        assert all(event.wait(10) for event in started.values())
+        calls.append(name)
+        if error:
+            raise RuntimeError(error)
+
+    monkeypatch.setattr(github.GithubRelease, "prepare", lambda self: pipeline("github", github_error))
+    monkeypatch.setattr(github.GithubRelease, "publish", lambda self: calls.append("publish"))
+    monkeypatch.setattr(pypi, "upload", lambda *args, **kwargs: pipeline("pypi", pypi_error))
+
+    if not (github_error or pypi_error):
+        api.release("pypi", dry_run = False)
+        assert sorted(calls[:2]) == ["github", "pypi"] and calls[2:] == ["publish"]
+        return
+
+    with caplog.at_level(logging.ERROR), pytest.raises(RuntimeError, match = github_error or pypi_error):
+        api.release("pypi", dry_run = False)
+
+    # Both pipelines ran to completion, but the GitHub release wasn't published.
+    assert sorted(calls) == ["github", "pypi"]
+    # Only the first error is raised; the other one is logged.
+    assert caplog.messages == (["PyPi failed"] if github_error and pypi_error else [])
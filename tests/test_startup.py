@@ -0,0 +1,38 @@
+import zipfile
+
+import pytest
+
+from bork import pyz, startup
+
+
+def _zipapp(tmp_path, name, main):
+    wheel = tmp_path / f"{name}-1.0-py3-none-any.whl"
+    with zipfile.ZipFile(wheel, "w") as zf:
+        zf.writestr(f"{name}/__init__.py", "")
+        zf.writestr(f"{name}/main.py", main)
+
+    target = tmp_path / f"{name}.pyz"
+    pyz.assemble(target, [wheel], main = f"{name}.main:main", interpreter = None)
+    return target
+
+
+def test_profile(tmp_path):
+    "Ensure zipapps' start time and import times are measured, and compared"
+    app = _zipapp(tmp_path, "app", "import json\ndef main():\n    pass\n")
+    profile = startup.profile(app, runs = 2, args = ())
+
+    assert len(profile.wall) == 2
+    assert len(profile.cumulative["app.main"]) == 2
+    assert profile.median_cumulative("app.main") >= profile.median_cumulative("json")
+    assert "app.main" in startup.report(profile)
+
+    baseline = startup.profile(_zipapp(tmp_path, "base", "def main():\n    pass\n"), runs = 2, args = ())
+    comparison = startup.compare(profile, baseline)
+    assert "app.main" in comparison and "base.main" in comparison
+
+
+def test_profile_failure(tmp_path):
+    "Ensure zipapps which fail to run are reported"
+    app = _zipapp(tmp_path, "app", "def main():\n    raise SystemExit('broken')\n")
+    with pytest.raises(RuntimeError, match = "broken"):
+        startup.profile(app, runs = 1, args = ())
@@ -0,0 +1,37 @@
+from bork import trusted_publishing
+
+from types import SimpleNamespace
+
+
+def test_get_token_cached(monkeypatch):
+    requests = []
+
+    def request(method, url, **kwargs):
+        requests.append((method, url))
+        if url.endswith("/_/oidc/audience"):
+            return SimpleNamespace(json = lambda: {"audience": "pypi"})
+        if url.endswith("/_/oidc/mint-token"):
+            return SimpleNamespace(json = lambda: {"token": f"token-{len(requests)}", "expires": now + 300})
+        return SimpleNamespace(json = lambda: {"value": "oidc"})
+
+    now = 1_000_000
+    monkeypatch.setattr(trusted_publishing.time, "time", lambda: now)
+    monkeypatch.setattr(trusted_publishing.http, "request", request)
+    monkeypatch.setattr(trusted_publishing.http, "get", lambda url, **kwargs: request("GET", url, **kwargs))
+    monkeypatch.setattr(trusted_publishing, "_tokens", {})
+    monkeypatch.setenv("CI", "true")
+    monkeypatch.setenv("GITHUB_ACTION", "release")
+    monkeypatch.setenv("ACTIONS_ID_TOKEN_REQUEST_TOKEN", "actions-token")
+    monkeypatch.setenv("ACTIONS_ID_TOKEN_REQUEST_URL", "https://actions.example/token?v=1")
+    trusted_publishing.get_audience.cache_clear()
+
+    repository = "https://upload.example/legacy/"
+    token = trusted_publishing.get_token(repository)
+    assert len(requests) == 3
+    assert all(trusted_publishing.get_token(repository) == token for _ in range(20))
+    assert len(requests) == 3
+
+    # Tokens about to expire are minted again, but the audience is still known.
+    now += 300 - trusted_publishing.EXPIRY_MARGIN
+    assert trusted_publishing.get_token(repository) != token
+    assert [method for (method, _) in requests] == ["GET", "GET", "POST", "GET", "POST"]